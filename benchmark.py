@@ -0,0 +1,451 @@
+"""Benchmark harness for scanner.scan_folder on a reproducible synthetic corpus.
+
+python benchmark.py generate CORPUS_DIR [--seed N] [--scale F]
+python benchmark.py run CORPUS_DIR [--jobs N] [--backend NAME] [--mmap] [-o results.json]
+python benchmark.py startup [--repeat N] [-o results.json]
+python benchmark.py compare OLD.json NEW.json
+"""
+
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import pikepdf
+import pypdf
+from PIL import Image
+
+import scanner
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+# Number of files per category at scale 1.0.
+CORPUS_COUNTS = {
+    "small": 500,
+    "huge": 2,
+    "image_heavy": 20,
+    "shared": 20,
+    "big_xmp": 10,
+    "malformed": 20,
+}
+HUGE_PAGES = 2000
+# Modules that ``import scanner`` must leave unexecuted until a scan needs them.
+STARTUP_LAZY_MODULES = (
+    "pikepdf",
+    "pypdf",
+    "PIL.Image",
+    "tqdm",
+    "asyncio",
+    "sqlite3",
+    "logging.handlers",
+)
+IMAGE_HEAVY_PAGES = 20
+SHARED_PAGES = 50
+BIG_XMP_BYTES = 2_000_000
+
+XMP_TEMPLATE = """<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmlns:xmpGImg="http://ns.adobe.com/xap/1.0/g/img/">
+   <dc:title><rdf:Alt><rdf:li xml:lang="x-default">{title}</rdf:li></rdf:Alt></dc:title>
+   <dc:creator><rdf:Seq><rdf:li>{creator}</rdf:li></rdf:Seq></dc:creator>
+   <xmp:Thumbnails><rdf:Alt><rdf:li rdf:parseType="Resource">
+    <xmpGImg:format>JPEG</xmpGImg:format>
+    <xmpGImg:image>{thumbnail}</xmpGImg:image>
+   </rdf:li></rdf:Alt></xmp:Thumbnails>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>"""
+
+
+def _jpeg_with_exif(rng, size=64):
+    img = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    exif = img.getexif()
+    exif[0x010F] = rng.choice(["Canon", "Nikon", "Fujifilm", "Apple"])
+    exif[0x0110] = f"Model {rng.randrange(100)}"
+    exif[0x0131] = "benchmark corpus"
+    bio = io.BytesIO()
+    img.save(bio, format="JPEG", exif=exif, quality=85)
+    return bio.getvalue()
+
+
+def _flate_image(pdf, rng, size=64):
+    # What a PNG becomes inside a PDF: bare Flate-compressed samples (tEXt chunks are lost).
+    image = pikepdf.Stream(
+        pdf,
+        b"",
+        Type=pikepdf.Name.XObject,
+        Subtype=pikepdf.Name.Image,
+        Width=size,
+        Height=size,
+        ColorSpace=pikepdf.Name.DeviceRGB,
+        BitsPerComponent=8,
+    )
+    image.write(rng.randbytes(size * size * 3), filter=pikepdf.Name.FlateDecode)
+    return image
+
+
+def _jpeg_image(pdf, data, size=64):
+    return pikepdf.Stream(
+        pdf,
+        data,
+        Type=pikepdf.Name.XObject,
+        Subtype=pikepdf.Name.Image,
+        Width=size,
+        Height=size,
+        ColorSpace=pikepdf.Name.DeviceRGB,
+        BitsPerComponent=8,
+        Filter=pikepdf.Name.DCTDecode,
+    )
+
+
+def _place_images(pdf, page, images):
+    page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(images))
+    ops = "".join(f"q 64 0 0 64 {72 * i} 72 cm {name} Do Q\n" for i, name in enumerate(images))
+    page.Contents = pdf.make_stream(ops.encode())
+
+
+def _new_pdf(rng, pages):
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    pdf.docinfo["/Title"] = f"Synthetic document {rng.randrange(10**6)}"
+    pdf.docinfo["/Author"] = rng.choice(["Alice", "Bob", "Carol", "Dave"])
+    pdf.docinfo["/Producer"] = "benchmark corpus"
+    return pdf
+
+
+def _save(pdf, path):
+    pdf.save(path, deterministic_id=True)
+    return path
+
+
+def _small(rng, path):
+    return _save(_new_pdf(rng, 1), path)
+
+
+def _huge(rng, path):
+    pdf = _new_pdf(rng, HUGE_PAGES)
+    for num, page in enumerate(pdf.pages):
+        page.Contents = pdf.make_stream(f"BT /F1 12 Tf 72 720 Td (Page {num}) Tj ET".encode())
+    return _save(pdf, path)
+
+
+def _image_heavy(rng, path):
+    pdf = _new_pdf(rng, IMAGE_HEAVY_PAGES)
+    for page in pdf.pages:
+        _place_images(
+            pdf,
+            page,
+            {
+                "/Im0": _jpeg_image(pdf, _jpeg_with_exif(rng)),
+                "/Im1": _jpeg_image(pdf, _jpeg_with_exif(rng)),
+                "/Im2": _flate_image(pdf, rng),
+            },
+        )
+    return _save(pdf, path)
+
+
+def _shared(rng, path):
+    pdf = _new_pdf(rng, SHARED_PAGES)
+    letterhead = pdf.make_indirect(_jpeg_image(pdf, _jpeg_with_exif(rng)))
+    for page in pdf.pages:
+        _place_images(pdf, page, {"/Letterhead": letterhead})
+    return _save(pdf, path)
+
+
+def _big_xmp(rng, path):
+    pdf = _new_pdf(rng, 1)
+    thumbnail = base64.b64encode(rng.randbytes(BIG_XMP_BYTES * 3 // 4)).decode()
+    xmp = XMP_TEMPLATE.format(
+        title=pdf.docinfo["/Title"], creator=pdf.docinfo["/Author"], thumbnail=thumbnail
+    )
+    pdf.Root.Metadata = pdf.make_stream(
+        xmp.encode("utf-8"), Type=pikepdf.Name.Metadata, Subtype=pikepdf.Name.XML
+    )
+    return _save(pdf, path)
+
+
+def _malformed(rng, path):
+    valid = io.BytesIO()
+    _new_pdf(rng, 3).save(valid, deterministic_id=True)
+    data = valid.getvalue()
+    kind = rng.randrange(4)
+    if kind == 0:
+        data = data[: len(data) // 2]
+    elif kind == 1:
+        data = data.replace(b"xref", b"xxxx").replace(b"startxref", b"startjunk")
+    elif kind == 2:
+        data = b"%PDF-1.7\n" + rng.randbytes(4096)
+    else:
+        data = b""
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+GENERATORS = {
+    "small": _small,
+    "huge": _huge,
+    "image_heavy": _image_heavy,
+    "shared": _shared,
+    "big_xmp": _big_xmp,
+    "malformed": _malformed,
+}
+
+
+def generate_corpus(root, seed=0, scale=1.0, counts=None):
+    """Write the synthetic corpus under ``root`` and return its manifest.
+
+    The same ``seed``/``scale``/``counts`` always produce byte-identical files.
+    """
+    counts = counts or {name: max(1, round(n * scale)) for name, n in CORPUS_COUNTS.items()}
+    rng = random.Random(seed)
+    manifest = {"seed": seed, "counts": counts, "files": {}}
+    for category, generate in GENERATORS.items():
+        directory = os.path.join(root, category)
+        os.makedirs(directory, exist_ok=True)
+        manifest["files"][category] = [
+            generate(rng, os.path.join(directory, f"{category}_{i:05d}.pdf"))
+            for i in range(counts.get(category, 0))
+        ]
+    with open(os.path.join(root, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    usage = [
+        resource.getrusage(who).ru_maxrss
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ]
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return max(usage) // 1024 if sys.platform == "darwin" else max(usage)
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pikepdf": pikepdf.__version__,
+        "pypdf": pypdf.__version__,
+    }
+
+
+def run_benchmark(corpus, jobs=1, backend=scanner.DEFAULT_BACKEND, repeat=3, use_mmap=False):
+    """Scan ``corpus`` ``repeat`` times and report the fastest run as a JSON-able dict."""
+    root = logging.getLogger()
+    quiet = logging.NullHandler()
+    root.addHandler(quiet)
+    runs = []
+    try:
+        for _ in range(repeat):
+            stats = scanner.ScanStats()
+            started = time.perf_counter()
+            with scanner.open_output(os.devnull) as out:
+                scanner.scan_folder(
+                    corpus, out, jobs=jobs, stats=stats, backend=backend, use_mmap=use_mmap
+                )
+            wall = time.perf_counter() - started
+            runs.append((wall, stats.snapshot()))
+    finally:
+        root.removeHandler(quiet)
+
+    wall, snap = min(runs, key=lambda run: run[0])
+    return {
+        "environment": environment(),
+        "params": {
+            "corpus": corpus,
+            "jobs": jobs,
+            "backend": backend,
+            "mmap": use_mmap,
+            "repeat": repeat,
+        },
+        "results": {
+            "files": snap["files"],
+            "failed": snap["failed"],
+            "wall": round(wall, 4),
+            "walls": [round(w, 4) for w, _ in runs],
+            "files_per_sec": round(snap["files"] / wall, 3),
+            "pages_per_sec": round(snap["counters"].get("pages", 0) / wall, 3),
+            "peak_rss_kb": peak_rss_kb(),
+            "stages": snap["stages"],
+            "slowest": snap["slowest"],
+        },
+    }
+
+
+def _import_times(stderr):
+    """Parse ``python -X importtime`` output into ``{module: (self_us, cumulative_us)}``."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def _best_wall(command, env, repeat):
+    walls = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, env=env, check=True, capture_output=True)
+        walls.append(time.perf_counter() - started)
+    return min(walls)
+
+
+def startup_benchmark(repeat=5, top_n=10):
+    """Time ``import scanner`` and ``pdfscan --help`` in fresh interpreters.
+
+    Also reports the ``-X importtime`` breakdown of the import and which of
+    STARTUP_LAZY_MODULES it executed (which should be none).
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=root)
+    # Installed entry points run from cached bytecode; measure that, not recompiling.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    python = [sys.executable, "-c"]
+    help_code = "import sys, scanner; sys.argv = ['pdfscan', '--help']; scanner.main()"
+    subprocess.run([*python, "import scanner"], env=env, check=True)
+
+    traced = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import scanner"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times = _import_times(traced.stderr)
+    slowest = sorted(((us, name) for name, (us, _) in times.items()), reverse=True)[:top_n]
+    return {
+        "environment": environment(),
+        "params": {"repeat": repeat},
+        "results": {
+            "import_wall": round(_best_wall([*python, "import scanner"], env, repeat), 4),
+            "help_wall": round(_best_wall([*python, help_code], env, repeat), 4),
+            "baseline_wall": round(_best_wall([*python, "pass"], env, repeat), 4),
+            "import_us": times["scanner"][1],
+            "eager_modules": [name for name in STARTUP_LAZY_MODULES if name in times],
+            "slowest_imports": [[us, name.strip()] for us, name in slowest],
+        },
+    }
+
+
+COMPARED_METRICS = (
+    "wall",
+    "files_per_sec",
+    "pages_per_sec",
+    "peak_rss_kb",
+    "import_wall",
+    "help_wall",
+    "import_us",
+)
+
+
+def compare(old, new):
+    """Return lines comparing the headline metrics of two benchmark results."""
+    lines = [f"{'metric':<16}{'old':>14}{'new':>14}{'change':>10}"]
+    for metric in COMPARED_METRICS:
+        if metric not in old["results"] and metric not in new["results"]:
+            continue
+        before, after = old["results"].get(metric), new["results"].get(metric)
+        change = f"{(after - before) / before:+.1%}" if before and after is not None else "n/a"
+        lines.append(f"{metric:<16}{before!s:>14}{after!s:>14}{change:>10}")
+    old_stages = old["results"].get("stages", {})
+    new_stages = new["results"].get("stages", {})
+    for stage in sorted(set(old_stages) | set(new_stages)):
+        before = old_stages.get(stage, [None])[0]
+        after = new_stages.get(stage, [None])[0]
+        change = f"{(after - before) / before:+.1%}" if before and after is not None else "n/a"
+        lines.append(f"{'stage ' + stage:<16}{before!s:>14}{after!s:>14}{change:>10}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF metadata scanner.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="write the synthetic corpus")
+    gen.add_argument("corpus", help="directory to create the corpus in")
+    gen.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+    gen.add_argument(
+        "--scale", type=float, default=1.0, help="multiply file counts (default: %(default)s)"
+    )
+
+    run = sub.add_parser("run", help="scan the corpus and report timings as JSON")
+    run.add_argument("corpus", help="corpus directory created by 'generate'")
+    run.add_argument("-j", "--jobs", type=int, default=1, help="worker processes")
+    run.add_argument("--backend", choices=scanner.BACKENDS, default=scanner.DEFAULT_BACKEND)
+    run.add_argument("--mmap", action="store_true", help="read files through memory maps")
+    run.add_argument("--repeat", type=int, default=3, help="runs; the fastest is reported")
+    run.add_argument("-o", "--out", help="write the JSON result here instead of stdout")
+
+    start = sub.add_parser("startup", help="time interpreter start-up and import as JSON")
+    start.add_argument("--repeat", type=int, default=5, help="runs; the fastest is reported")
+    start.add_argument("-o", "--out", help="write the JSON result here instead of stdout")
+
+    cmp = sub.add_parser("compare", help="compare two JSON results")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        manifest = generate_corpus(args.corpus, seed=args.seed, scale=args.scale)
+        total = sum(manifest["counts"].values())
+        print(f"Wrote {total} PDFs to {args.corpus}")
+    elif args.command in ("run", "startup"):
+        if args.command == "run":
+            result = run_benchmark(
+                args.corpus,
+                jobs=args.jobs,
+                backend=args.backend,
+                repeat=args.repeat,
+                use_mmap=args.mmap,
+            )
+        else:
+            result = startup_benchmark(repeat=args.repeat)
+        text = json.dumps(result, indent=2)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+    else:
+        with open(args.old, encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        print("\n".join(compare(old, new)))
+
+
+if __name__ == "__main__":
+    main()
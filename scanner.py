@@ -1,139 +1,2809 @@
+import abc
 import argparse
+import copy
+import fnmatch
+import hashlib
+import heapq
+import importlib.util
 import io
+import json
 import logging
+import mmap
 import os
+import queue
+import re
+import signal
+import struct
 import sys
-from xml.etree import ElementTree as ET
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import ExitStack, contextmanager, nullcontext, suppress
+from functools import partial
+from operator import itemgetter
+from typing import Callable, NamedTuple
 
-import pikepdf
-from PIL import Image
-from pypdf import PdfReader
-from tqdm import tqdm
 
+def _lazy_import(name):
+    """Return module ``name``, deferring its execution until an attribute is first used."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
-def setup_logger(log_path, verbose=False):
-    handlers = [logging.FileHandler(log_path, mode="w", encoding="utf-8")]
+
+def _load_now(*modules):
+    """Execute lazily imported ``modules`` now instead of on their first use."""
+    for module in modules:
+        vars(module)  # any attribute lookup runs the deferred import
+
+
+# The PDF backends, PIL and tqdm dominate start-up, and most of the standard library
+# modules below are only needed by some modes. Each is executed on first use, so --help,
+# runs served from the cache and ``pdfscan merge`` never load the parsers
+# (``python benchmark.py startup`` keeps an eye on this).
+asyncio = _lazy_import("asyncio")
+process_pool = _lazy_import("concurrent.futures.process")
+csv = _lazy_import("csv")
+sqlite3 = _lazy_import("sqlite3")
+tempfile = _lazy_import("tempfile")
+ctypes = _lazy_import("ctypes")
+ET = _lazy_import("xml.etree.ElementTree")
+logging_handlers = _lazy_import("logging.handlers")
+pikepdf = _lazy_import("pikepdf")
+pypdf = _lazy_import("pypdf")
+Image = _lazy_import("PIL.Image")
+tqdm = _lazy_import("tqdm")
+
+
+class _QueueLogHandler(logging.Handler):
+    """Pass log records to a QueueListener thread that runs the real ``handlers``.
+
+    Logging from the scan costs a queue put; formatting and disk writes happen on the
+    listener's thread. Closing the handler (as logging.shutdown does) drains the queue.
+    """
+
+    def __init__(self, handlers):
+        super().__init__()
+        self.queue_handler = logging_handlers.QueueHandler(queue.SimpleQueue())
+        self.listener = logging_handlers.QueueListener(self.queue_handler.queue, *handlers)
+        self.listener.start()
+
+    def emit(self, record):
+        self.queue_handler.emit(record)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+        super().close()
+
+
+def setup_logger(log_path, verbose=False, append=False):
+    handlers = [logging.FileHandler(log_path, mode="a" if append else "w", encoding="utf-8")]
     if verbose:
         handlers.append(logging.StreamHandler(sys.stdout))
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # force closes the handlers of an earlier call rather than leaving them open.
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        handlers=[_QueueLogHandler(handlers)],
+        force=True,
+    )
+
+
+BACKENDS = ("pikepdf", "pypdf")
+DEFAULT_BACKEND = "pikepdf"
+
+# Only JPEG and JPEG 2000 streams hold a complete image file that can carry EXIF/XMP;
+# every other image filter decodes to bare pixel samples.
+PASSTHROUGH_IMAGE_FILTERS = {"/DCTDecode", "/JPXDecode"}
+JP2_XMP_UUID = bytes.fromhex("be7acfcb97a942e89c71999491e3afac")
+JP2_EXIF_UUID = b"JpgTiffExif->JP2"
+# Inline images: ``BI <key/value pairs> ID <data> EI``; /F is the abbreviation of /Filter.
+INLINE_IMAGE = re.compile(rb"(?:^|(?<=\s))BI\s(.*?)\sID\s", re.S)
+INLINE_IMAGE_FILTER = re.compile(rb"/F(?:ilter)?\s*\[?\s*(/[^\s/\[\]]+(?:\s*/[^\s/\[\]]+)*)")
+IGNORED_IMAGE_KEYS = {
+    "jfif",
+    "jfif_version",
+    "jfif_unit",
+    "jfif_density",
+    "dpi",
+    "adobe",
+    "adobe_transform",
+}
+
+
+STAGES = ("open", "docinfo", "xmp", "images", "image_decode", "attachments")
+# Extraction stages that --only can select, in the order they run.
+EXTRACT_STAGES = ("docinfo", "xmp", "images")
+
+
+class FileStats:
+    """Wall/CPU time per extraction stage and simple counters for one file."""
+
+    def __init__(self, pdf_path):
+        self.path = pdf_path
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(name, [0.0, 0.0])
+            totals[0] += time.perf_counter() - wall
+            totals[1] += time.process_time() - cpu
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self):
+        return {"path": self.path, "stages": self.stages, "counters": self.counters}
+
+
+_file_stats = None
+
+
+@contextmanager
+def track_file(pdf_path):
+    """Collect FileStats for everything the extractors do inside this block."""
+    global _file_stats
+    previous, _file_stats = _file_stats, FileStats(pdf_path)
+    try:
+        try:
+            _file_stats.count("bytes", os.path.getsize(pdf_path))
+        except OSError:
+            pass
+        with _file_stats.stage("total"):
+            yield _file_stats
+    finally:
+        _file_stats = previous
+
+
+def stage(name):
+    return _file_stats.stage(name) if _file_stats is not None else nullcontext()
+
+
+def count(name, amount=1):
+    if _file_stats is not None:
+        _file_stats.count(name, amount)
+
+
+class ScanStats:
+    """Aggregate FileStats over a scan: throughput, per-stage totals and slowest files.
+
+    With ``interval`` set, a JSON snapshot line is written to ``stream`` at most once
+    per ``interval`` seconds as files complete.
+    """
+
+    def __init__(self, top_n=10, interval=None, stream=None):
+        self.top_n = top_n
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.started = time.perf_counter()
+        self.last_emit = self.started
+        self.files = 0
+        self.cached = 0
+        self.failed = 0
+        self.stages = {}
+        self.counters = {}
+        self.slowest = []
+        # Fixed wall time for stats that were not measured live (see from_snapshots).
+        self.elapsed = None
+
+    @classmethod
+    def from_snapshots(cls, snapshots, top_n=10):
+        """Combine the final snapshots of shards that scanned side by side."""
+        stats = cls(top_n)
+        stats.elapsed = 0.0
+        for snap in snapshots:
+            stats.elapsed = max(stats.elapsed, snap["elapsed"])
+            stats.files += snap["files"]
+            stats.cached += snap["cached"]
+            stats.failed += snap["failed"]
+            stats._add_totals(snap["stages"], snap["counters"])
+            for wall, path in snap["slowest"]:
+                stats._rank(wall, path)
+        return stats
+
+    def _add_totals(self, stages, counters):
+        for name, (wall, cpu) in stages.items():
+            totals = self.stages.setdefault(name, [0.0, 0.0])
+            totals[0] += wall
+            totals[1] += cpu
+        for name, amount in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _rank(self, wall, path):
+        if len(self.slowest) < self.top_n:
+            heapq.heappush(self.slowest, (wall, path))
+        elif self.top_n:
+            heapq.heappushpop(self.slowest, (wall, path))
+
+    def add(self, file_stats, failed=False):
+        self.files += 1
+        if failed:
+            self.failed += 1
+        elif file_stats is None:
+            self.cached += 1
+        else:
+            self._add_totals(file_stats["stages"], file_stats["counters"])
+            self._rank(file_stats["stages"].get("total", [0.0])[0], file_stats["path"])
+
+        if self.interval is not None:
+            now = time.perf_counter()
+            if now - self.last_emit >= self.interval:
+                self.last_emit = now
+                print(json.dumps(self.snapshot()), file=self.stream, flush=True)
+
+    def snapshot(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        elapsed = max(elapsed, 1e-9)
+        return {
+            "elapsed": round(elapsed, 3),
+            "files": self.files,
+            "cached": self.cached,
+            "failed": self.failed,
+            "files_per_sec": round(self.files / elapsed, 3),
+            "pages_per_sec": round(self.counters.get("pages", 0) / elapsed, 3),
+            "mb_per_sec": round(self.counters.get("bytes", 0) / elapsed / 1e6, 3),
+            "counters": self.counters,
+            "stages": {name: [round(w, 6), round(c, 6)] for name, (w, c) in self.stages.items()},
+            "slowest": [[round(w, 6), path] for w, path in sorted(self.slowest, reverse=True)],
+        }
+
+    def summary(self):
+        snap = self.snapshot()
+        lines = [
+            f"Scanned {snap['files']} files ({snap['cached']} from cache, {snap['failed']} failed)"
+            f" in {snap['elapsed']:.1f}s: {snap['files_per_sec']:.1f} files/s,"
+            f" {snap['pages_per_sec']:.1f} pages/s, {snap['mb_per_sec']:.1f} MB/s",
+            f"{'stage':<14}{'wall s':>10}{'cpu s':>10}",
+        ]
+        for name in ("total", *STAGES):
+            if name in self.stages:
+                wall, cpu = self.stages[name]
+                lines.append(f"{name:<14}{wall:>10.3f}{cpu:>10.3f}")
+        if self.slowest:
+            lines.append("slowest files:")
+            lines.extend(f"{wall:>10.3f}s  {path}" for wall, path in snap["slowest"])
+        return "\n".join(lines)
+
+
+RDF_NS = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+RDF_TAG = f"{RDF_NS}RDF"
+XML_NS = "{http://www.w3.org/XML/1998/namespace}"
+XMP_CONTAINERS = {f"{RDF_NS}Seq", f"{RDF_NS}Bag", f"{RDF_NS}Alt"}
+XMP_FEED_SIZE = 64 * 1024
+
+
+def _key(name):
+    # The same few metadata names recur on every image and document; share one string each.
+    return sys.intern(str(name))
+
+
+def _plain_map(mapping):
+    return {key: _plain(value) for key, value in mapping.items()}
+
+
+class _Record:
+    """Slotted result object, compared field by field.
+
+    Results are held for every image of a document and shipped from workers to the
+    parent, so they carry no per-instance ``__dict__``. ``as_dict`` gives the plain form
+    written to outputs and the cache.
+    """
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class ImageRecord(_Record):
+    """An image with metadata, reported once with every page it appears on.
+
+    ``metadata`` keeps the values PIL returned; they are only turned into strings when the
+    record is written, so byte strings (ICC profiles, raw EXIF) are never held as reprs.
+    """
+
+    __slots__ = ("name", "pages", "metadata")
+
+    def __init__(self, name, pages, metadata):
+        self.name = name
+        self.pages = pages
+        self.metadata = metadata
+
+    def as_dict(self):
+        return {"name": self.name, "pages": self.pages, "metadata": _plain_map(self.metadata)}
+
+
+class AttachmentRecord(_Record):
+    """An embedded file: an image's metadata, or the DocumentRecord of an attached PDF."""
+
+    __slots__ = ("name", "source", "size", "metadata", "document", "skipped")
+
+    def __init__(self, name, source, size=None, metadata=None, document=None, skipped=None):
+        self.name = name
+        self.source = source
+        self.size = size
+        self.metadata = metadata if metadata is not None else {}
+        self.document = document
+        self.skipped = skipped
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "source": self.source,
+            "size": self.size,
+            "metadata": _plain_map(self.metadata),
+            "document": None if self.document is None else self.document.as_dict(),
+            "skipped": self.skipped,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        document = data["document"]
+        return cls(
+            data["name"],
+            data["source"],
+            data["size"],
+            {_key(k): v for k, v in data["metadata"].items()},
+            None if document is None else DocumentRecord.from_dict(document),
+            data["skipped"],
+        )
+
+
+class DocumentRecord(_Record):
+    """Everything extracted from one PDF; starts empty and extraction fills it in."""
+
+    __slots__ = (
+        "path",
+        "duplicates",
+        "docinfo",
+        "xmp",
+        "xmp_packet",
+        "images",
+        "attachments",
+        "skipped",
+    )
+
+    def __init__(
+        self,
+        path,
+        duplicates=None,
+        docinfo=None,
+        xmp=None,
+        xmp_packet=None,
+        images=None,
+        attachments=None,
+        skipped=None,
+    ):
+        self.path = path
+        self.duplicates = duplicates if duplicates is not None else []
+        self.docinfo = docinfo if docinfo is not None else {}
+        self.xmp = xmp if xmp is not None else {}
+        self.xmp_packet = xmp_packet
+        self.images = images if images is not None else []
+        self.attachments = attachments if attachments is not None else []
+        self.skipped = skipped
+
+    def has_metadata(self):
+        """True if extraction found any docinfo, XMP property, image metadata or attachment."""
+        return bool(self.docinfo or self.xmp or self.images or self.attachments)
+
+    def as_dict(self):
+        """Return the record as JSON-ready dicts and lists, with keys in RECORD_FIELDS order."""
+        return {
+            "path": self.path,
+            "duplicates": self.duplicates,
+            "docinfo": self.docinfo,
+            "xmp": self.xmp,
+            "xmp_packet": self.xmp_packet,
+            "images": [image.as_dict() for image in self.images],
+            "attachments": [attachment.as_dict() for attachment in self.attachments],
+            "skipped": self.skipped,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a record from ``as_dict`` output (the cache, or a file being merged)."""
+        return cls(
+            data["path"],
+            data.get("duplicates", []),
+            {_key(k): v for k, v in data["docinfo"].items()},
+            {_key(k): v for k, v in data["xmp"].items()},
+            data["xmp_packet"],
+            [
+                ImageRecord(
+                    image["name"],
+                    image["pages"],
+                    {_key(k): v for k, v in image["metadata"].items()},
+                )
+                for image in data["images"]
+            ],
+            [AttachmentRecord.from_dict(attachment) for attachment in data["attachments"]],
+            data["skipped"],
+        )
+
+
+def parse_stages(spec):
+    """Parse a comma-separated subset of EXTRACT_STAGES, returned in run order."""
+    names = {name.strip() for name in spec.split(",") if name.strip()}
+    unknown = names.difference(EXTRACT_STAGES)
+    if unknown or not names:
+        choices = ", ".join(EXTRACT_STAGES)
+        raise argparse.ArgumentTypeError(f"expected a comma-separated list of {choices}")
+    return tuple(name for name in EXTRACT_STAGES if name in names)
+
+
+def _plain(value):
+    # Records travel through JSON (workers, cache, jsonl). Anything that is not a JSON
+    # scalar is kept as the string the text output shows for it.
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _docinfo_fields(docinfo):
+    # Sorted by key: pikepdf lists them in set order, which follows the hash seed, so the
+    # same file would come out differently from one process to the next.
+    items = sorted(docinfo.items(), key=lambda item: str(item[0]))
+    return {_key(k): _plain(v) for k, v in items}
+
+
+def print_docinfo(docinfo, pdf_path, out):
+    if docinfo:
+        print(f"[PDF Metadata] {pdf_path}", file=out)
+        for key, value in docinfo.items():
+            print(f"    {key}: {value}", file=out)
+
+
+def _qname(tag, prefixes):
+    uri, _, local = tag[1:].rpartition("}")
+    return f"{prefixes.get(uri, uri)}:{local}"
+
+
+def _xmp_attributes(node, key, properties, prefixes):
+    # Shorthand properties (and struct fields) written as attributes; returns how many.
+    found = 0
+    for name, value in node.attrib.items():
+        if not name.startswith((RDF_NS, XML_NS)):
+            properties[f"{key}{_qname(name, prefixes)}"] = value
+            found += 1
+    return found
+
+
+def _xmp_fields(node, key, properties, prefixes):
+    # A description or struct: attributes and child elements are its properties.
+    _xmp_attributes(node, key, properties, prefixes)
+    for field in node:
+        _xmp_property(field, f"{key}{_qname(field.tag, prefixes)}", properties, prefixes)
+
+
+def _xmp_property(elem, key, properties, prefixes):
+    resource = elem.get(f"{RDF_NS}resource")
+    if resource is not None:
+        properties[key] = resource
+    if elem.get(f"{RDF_NS}parseType") == "Resource":
+        _xmp_fields(elem, f"{key}/", properties, prefixes)
+        return
+    fields = _xmp_attributes(elem, f"{key}/", properties, prefixes)
+
+    if len(elem) == 0:
+        if resource is None and not fields:
+            properties[key] = (elem.text or "").strip()
+        return
+    for child in elem:
+        if child.tag not in XMP_CONTAINERS:
+            _xmp_fields(child, f"{key}/", properties, prefixes)
+            continue
+        items = child.findall(f"{RDF_NS}li")
+        langs = [item.get(f"{XML_NS}lang") for item in items]
+        for index, (item, lang) in enumerate(zip(items, langs, strict=True), start=1):
+            if child.tag != f"{RDF_NS}Alt":
+                item_key = f"{key}[{index}]"
+            elif lang == "x-default" or (index == 1 and "x-default" not in langs):
+                item_key = key
+            else:
+                item_key = f"{key}[{lang or index}]"
+            _xmp_property(item, item_key, properties, prefixes)
+
+
+def parse_xmp(data, pdf_path):
+    """Return the properties of an XMP packet as a flat ``{"prefix:name": "value"}`` dict.
+
+    The raw bytes are fed to a pull parser in chunks and every top-level property is
+    flattened and discarded as soon as it is complete, so the packet is parsed once and
+    large packets (embedded thumbnails) are never held as a whole tree. Array items are
+    numbered (``dc:creator[1]``), struct fields are joined with ``/`` and the default
+    entry of a language alternative keeps the plain key.
+    """
+    properties = {}
+    if not data:
+        return properties
+    parser = ET.XMLPullParser(events=("start-ns", "start", "end"))
+    prefixes = {}
+    tags = []
+    try:
+        for offset in range(0, len(data), XMP_FEED_SIZE):
+            parser.feed(data[offset : offset + XMP_FEED_SIZE])
+            for event, item in parser.read_events():
+                if event == "start-ns":
+                    prefix, uri = item
+                    prefixes.setdefault(uri, prefix)
+                elif event == "start":
+                    if tags and tags[-1] == RDF_TAG:
+                        _xmp_attributes(item, "", properties, prefixes)
+                    tags.append(item.tag)
+                else:
+                    tags.pop()
+                    if len(tags) >= 2 and tags[-2] == RDF_TAG:
+                        _xmp_property(item, _qname(item.tag, prefixes), properties, prefixes)
+                        item.clear()
+        parser.close()
+    except Exception as e:
+        logging.warning(f"Failed to parse XMP/RDF in {pdf_path}: {e}")
+    return properties
+
+
+def print_xmp_properties(properties, packet, pdf_path, out):
+    if properties:
+        print(f"[XMP Metadata] {pdf_path}", file=out)
+        for key, value in properties.items():
+            print(f"    {key}: {value}", file=out)
+    if packet is not None:
+        print(f"[XMP Packet] {pdf_path}", file=out)
+        print(packet, file=out)
+
+
+def _is_pikepdf(obj):
+    # Objects are told apart by their type's module: an isinstance check against the
+    # other backend's classes would import it.
+    return type(obj).__module__.startswith("pikepdf")
+
+
+def _is_pypdf(obj):
+    return type(obj).__module__.startswith("pypdf")
+
+
+def _resolve(obj):
+    # pypdf hands out IndirectObject references; pikepdf resolves them transparently
+    # (and raises ValueError rather than AttributeError when probed for get_object).
+    if _is_pikepdf(obj):
+        return obj
+    return obj.get_object() if hasattr(obj, "get_object") else obj
+
+
+class FileSkipped(BaseException):
+    """A file hit a --file-timeout/--max-* limit and is abandoned.
+
+    Derives from BaseException so the ``except Exception`` guards around individual
+    stages (and inside the PDF libraries) do not swallow it.
+    """
+
+
+class DecodeLimitExceeded(FileSkipped):
+    """A FileLimits decoded-bytes budget ran out."""
+
+
+class FileFiltered(FileSkipped):
+    """A file fell outside a pre-filter (--min-pages) and is left out of the output."""
+
+
+class FileLimits:
+    """Per-file caps on page count and on the stream bytes decoded into memory.
+
+    ``min_pages`` is a filter rather than a cap: smaller files are dropped, not skipped.
+    """
+
+    def __init__(self, max_decoded_bytes=None, max_pages=None, min_pages=None):
+        self.max_decoded_bytes = max_decoded_bytes
+        self.max_pages = max_pages
+        self.min_pages = min_pages
+        self.decoded_bytes = 0
+
+    def remaining(self):
+        if self.max_decoded_bytes is None:
+            return None
+        return self.max_decoded_bytes - self.decoded_bytes
+
+    def charge(self, nbytes):
+        self.decoded_bytes += nbytes
+        if self.max_decoded_bytes is not None and self.decoded_bytes > self.max_decoded_bytes:
+            raise DecodeLimitExceeded(f"decoded more than {self.max_decoded_bytes} bytes")
+
+    def check_pages(self, pages, pdf_path):
+        if self.max_pages is None and self.min_pages is None:
+            return
+        try:
+            page_count = len(pages)
+        except Exception as e:
+            logging.warning(f"Could not count pages in {pdf_path}: {e}")
+            return
+        if self.max_pages is not None and page_count > self.max_pages:
+            raise FileSkipped(f"{page_count} pages exceeds the limit of {self.max_pages}")
+        if self.min_pages is not None and page_count < self.min_pages:
+            raise FileFiltered(f"{page_count} pages is below --min-pages {self.min_pages}")
+
+
+@contextmanager
+def deadline(seconds):
+    """Raise FileSkipped in the main thread if the block runs longer than ``seconds``.
+
+    Uses SIGALRM, so it is a no-op on platforms without it and outside the main thread.
+    Pure-Python loops (pypdf page trees, image traversal) are interrupted promptly; a
+    single long call into qpdf is interrupted when it returns.
+    """
+    if not seconds or not hasattr(signal, "SIGALRM"):
+        yield
+        return
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise FileSkipped(f"timed out after {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _inflate(raw, limits):
+    allowance = limits.remaining()
+    data = zlib.decompressobj().decompress(raw, max(allowance, 0) + 1)
+    if len(data) > allowance:
+        raise DecodeLimitExceeded(f"decoded more than {limits.max_decoded_bytes} bytes")
+    return data
+
+
+def _raw_bytes(obj):
+    if _is_pikepdf(obj):
+        return obj.read_raw_bytes()
+    # pypdf keeps an encoded stream's undecoded bytes in _data and has no accessor for them.
+    if isinstance(obj, pypdf.generic.EncodedStreamObject):
+        return obj._data
+    return obj.get_data()
+
+
+def _decoded_bytes(obj):
+    return obj.read_bytes() if _is_pikepdf(obj) else obj.get_data()
+
+
+def read_stream(obj, limits):
+    """Return a stream's decoded bytes, never inflating past the decoded-bytes budget.
+
+    Unfiltered and plain /FlateDecode streams are inflated here and abandoned at the cap;
+    other filter chains are decoded by the backend and charged once they are complete.
+    """
+    if limits.remaining() is None:
+        data = _decoded_bytes(obj)
+    else:
+        filters = _image_filters(obj)
+        if not filters:
+            data = _raw_bytes(obj)
+        elif filters == ["/FlateDecode"] and "/DecodeParms" not in obj:
+            data = _inflate(_raw_bytes(obj), limits)
+        else:
+            data = _decoded_bytes(obj)
+    limits.charge(len(data))
+    return data
+
+
+def _image_filters(obj):
+    filters = _resolve(obj.get("/Filter"))
+    if not filters:
+        return []
+    if _is_array(filters):
+        return [str(f) for f in filters]
+    return [str(filters)]
+
+
+def _read_image_data(obj, filters, limits):
+    # JPEG/JPEG2000 streams are passed through: their raw bytes are the image file.
+    if len(filters) == 1:
+        if _is_pikepdf(obj):
+            # Hand out qpdf's buffer without copying it into a bytes object.
+            data = memoryview(obj.get_raw_stream_buffer())
+        else:
+            data = _raw_bytes(obj)
+    elif filters[:-1] == ["/FlateDecode"]:
+        raw = _raw_bytes(obj)
+        data = zlib.decompress(raw) if limits.remaining() is None else _inflate(raw, limits)
+    elif not _is_pikepdf(obj):
+        # pypdf decodes every filter but the last one itself (qpdf refuses to).
+        data = obj.get_data()
+    else:
+        raise ValueError(f"unsupported filter chain {filters}")
+    limits.charge(len(data))
+    return data
+
+
+def jpeg_header(data):
+    """Return the leading part of a JPEG up to and including its start-of-scan header.
+
+    APPn segments (EXIF, XMP, ICC, Photoshop IRB) all precede the scan, so this is
+    everything Image.open needs to report metadata. Unparseable data is returned whole.
+    """
+    if data[:2] != b"\xff\xd8":
+        return data
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            break
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            pos += 2
+            continue
+        end = pos + 2 + int.from_bytes(data[pos + 2 : pos + 4], "big")
+        if marker == 0xDA:
+            return data[:end]
+        pos = end
+    return data
+
+
+def read_jp2_metadata(data):
+    """Collect XMP and EXIF from the top-level boxes of a JP2/JPX file.
+
+    The codestream box is skipped by its length, so pixel data is never touched.
+    """
+    metadata = {}
+    pos = 0
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos : pos + 4], "big")
+        box_type = bytes(data[pos + 4 : pos + 8])
+        header = 8
+        if length == 1:
+            length = int.from_bytes(data[pos + 8 : pos + 16], "big")
+            header = 16
+        elif length == 0:
+            length = len(data) - pos
+        if length < header:
+            break
+
+        if box_type in (b"xml ", b"uuid"):
+            payload = bytes(data[pos + header : pos + length])
+            if box_type == b"xml ":
+                metadata["xmp"] = payload
+            elif payload[:16] == JP2_XMP_UUID:
+                metadata["xmp"] = payload[16:]
+            elif payload[:16] == JP2_EXIF_UUID:
+                exif = Image.Exif()
+                exif.load(payload[16:])
+                metadata.update(exif)
+        pos += length
+    return metadata
+
+
+def read_jpeg_metadata(data):
+    return _pil_metadata(Image.open(io.BytesIO(jpeg_header(data))))
+
+
+def _pil_metadata(img):
+    metadata = img.info or {}
+    if hasattr(img, "getexif"):
+        exif = img.getexif()
+        if exif:
+            metadata.update(exif)
+    return metadata
+
+
+def read_image_metadata(obj, limits=None):
+    filters = _image_filters(obj)
+    if not filters or filters[-1] not in PASSTHROUGH_IMAGE_FILTERS:
+        return None
+
+    data = _read_image_data(obj, filters, limits or FileLimits())
+    count("image_bytes", len(data))
+    if filters[-1] == "/JPXDecode":
+        return read_jp2_metadata(data)
+    return read_jpeg_metadata(data)
+
+
+def format_pages(page_nums):
+    """Render page numbers as a compact list, e.g. ``1-3, 7``."""
+    ranges = []
+    for num in sorted(set(page_nums)):
+        if ranges and num == ranges[-1][1] + 1:
+            ranges[-1][1] = num
+        else:
+            ranges.append([num, num])
+    return ", ".join(f"{start}" if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def has_image_metadata(metadata):
+    return bool(metadata) and any(key not in IGNORED_IMAGE_KEYS for key in metadata.keys())
+
+
+def print_image_metadata(image, pdf_path, out):
+    pages = image.pages
+    label = "Page" if len(pages) == 1 else "Pages"
+    print(f"[Image Metadata] {pdf_path} - {label} {format_pages(pages)} - {image.name}", file=out)
+    for key, val in image.metadata.items():
+        print(f"    {key}: {val}", file=out)
+
+
+def _object_id(obj_ref, obj):
+    """Identify an indirect object so images shared across pages are read once."""
+    if _is_pikepdf(obj):
+        return obj.objgen if obj.is_indirect else None
+    if _is_pypdf(obj_ref) and isinstance(obj_ref, pypdf.generic.IndirectObject):
+        return (obj_ref.idnum, obj_ref.generation)
+    return None
+
+
+def _is_stream(obj):
+    if _is_pikepdf(obj):
+        return isinstance(obj, pikepdf.Stream)
+    return _is_pypdf(obj) and isinstance(obj, pypdf.generic.StreamObject)
+
+
+def _is_array(obj):
+    return isinstance(obj, list) or (_is_pikepdf(obj) and isinstance(obj, pikepdf.Array))
+
+
+def _content_streams(contents):
+    contents = _resolve(contents)
+    if _is_stream(contents):
+        return [contents]
+    if _is_array(contents):
+        return [stream for stream in map(_resolve, contents) if _is_stream(stream)]
+    return []
+
+
+def inline_jpegs(data):
+    """Yield the JPEG headers of the DCT-encoded inline images in a decoded content stream.
+
+    Only the header up to the start of scan is returned; the search resumes after it, so
+    the entropy-coded data is skipped over rather than tokenised.
+    """
+    if b"BI" not in data:
+        return
+    view = memoryview(data)
+    pos = 0
+    while match := INLINE_IMAGE.search(data, pos):
+        pos = match.end()
+        image_filter = INLINE_IMAGE_FILTER.search(match.group(1))
+        if image_filter and image_filter.group(1).split() in ([b"/DCT"], [b"/DCTDecode"]):
+            header = jpeg_header(view[pos:])
+            pos += len(header)
+            yield header
+
+
+class ImageWalker:
+    """Collect image metadata from a document's pages, Form XObjects and annotations.
+
+    Images are gathered from each page's /XObject resources, the Form XObjects nested
+    inside them and annotation appearance streams. Inline images are only found by
+    decoding every content stream, so they are looked for only with ``inline_images``.
+    Every indirect form is walked once per document: the images found beneath it are
+    remembered, so a form reused on another page (or referencing itself) only adds that
+    page to those images instead of being traversed again. With ``first_hit`` the walk
+    stops at the first image that carries metadata.
+    """
+
+    def __init__(self, pdf_path, limits, inline_images=False, first_hit=False):
+        self.pdf_path = pdf_path
+        self.limits = limits
+        self.inline_images = inline_images
+        self.first_hit = first_hit
+        self.images = []
+        # image key -> pages the image is reported on, or None if it has no metadata
+        self.seen = {}
+        # form object id -> keys of the images found beneath that form
+        self.forms = {}
+
+    @property
+    def done(self):
+        return self.first_hit and bool(self.images)
+
+    def walk_page(self, page, page_num):
+        self._walk_resources(page.get("/Resources", {}), page_num, "", [], None)
+        if "/Annots" in page:
+            self._walk_annotations(page.get("/Annots"), page_num)
+        if self.inline_images:
+            self._walk_content(page.get("/Contents"), page_num, "", [], None)
+
+    def _walk_resources(self, resources, page_num, prefix, found, scope):
+        xobjects = _resolve(resources).get("/XObject", None)
+        if not xobjects:
+            return
+
+        try:
+            xobjects = _resolve(xobjects)
+        except Exception:
+            return
+
+        for name, obj_ref in xobjects.items():
+            if self.done:
+                return
+            label = f"{prefix}{name}"
+            try:
+                obj = _resolve(obj_ref)
+                object_id = _object_id(obj_ref, obj)
+                if object_id is not None and self._revisit(object_id, page_num, found):
+                    continue
+                subtype = str(obj.get("/Subtype"))
+                if subtype == "/Form":
+                    self._walk_form(obj, object_id, page_num, label, found, scope)
+                elif subtype == "/Image":
+                    key = object_id if object_id is not None else self._scoped(scope, label)
+                    if self._claim(key, page_num, found):
+                        with stage("image_decode"):
+                            metadata = read_image_metadata(obj, self.limits)
+                        self._report(key, label, page_num, metadata)
+            except Exception as e:
+                logging.warning(f"Error reading image {label} in {self.pdf_path}: {e}")
+
+    def _walk_form(self, form, form_id, page_num, label, found, scope):
+        inner = []
+        if form_id is not None:
+            self.forms[form_id] = inner
+            scope = form_id
+        resources = form.get("/Resources")
+        if resources is not None:
+            self._walk_resources(resources, page_num, label, inner, scope)
+        if self.inline_images:
+            self._walk_content(form, page_num, label, inner, scope)
+        found.extend(inner)
+
+    def _walk_annotations(self, annots, page_num):
+        annots = _resolve(annots)
+        if not _is_array(annots):
+            return
+        for index, annot_ref in enumerate(annots):
+            try:
+                appearances = _resolve(_resolve(annot_ref).get("/AP"))
+                if not appearances:
+                    continue
+                for kind in ("/N", "/R", "/D"):
+                    appearance_ref = appearances.get(kind)
+                    appearance = _resolve(appearance_ref)
+                    label = f"/Annot{index}{kind}"
+                    if _is_stream(appearance):
+                        states = [(label, appearance_ref, appearance)]
+                    elif appearance:
+                        # A dictionary of appearance states, e.g. /On and /Off for a checkbox
+                        states = [
+                            (f"{label}{state}", ref, _resolve(ref))
+                            for state, ref in appearance.items()
+                        ]
+                    else:
+                        continue
+                    for state_label, ref, stream in states:
+                        if not _is_stream(stream):
+                            continue
+                        form_id = _object_id(ref, stream)
+                        if form_id is None or not self._revisit(form_id, page_num, []):
+                            self._walk_form(stream, form_id, page_num, state_label, [], None)
+            except Exception as e:
+                logging.warning(f"Error reading annotation {index} in {self.pdf_path}: {e}")
+
+    def _walk_content(self, contents, page_num, prefix, found, scope):
+        try:
+            index = 0
+            for stream in _content_streams(contents):
+                for header in inline_jpegs(read_stream(stream, self.limits)):
+                    label = f"{prefix}/BI{index}"
+                    index += 1
+                    key = self._scoped(scope, label)
+                    if self._claim(key, page_num, found):
+                        with stage("image_decode"):
+                            metadata = read_jpeg_metadata(header)
+                        self._report(key, label, page_num, metadata)
+        except Exception as e:
+            logging.warning(f"Error reading inline images in {self.pdf_path}: {e}")
+
+    @staticmethod
+    def _scoped(scope, label):
+        # Images without an object id of their own are identified within their form.
+        return None if scope is None else (scope, label)
+
+    def _revisit(self, object_id, page_num, found):
+        """Credit ``page_num`` to an image or form already walked; False if it is new."""
+        if object_id in self.forms:
+            keys = list(self.forms[object_id])
+        elif object_id in self.seen:
+            keys = [object_id]
+        else:
+            return False
+        for key in keys:
+            page_nums = self.seen.get(key)
+            if page_nums is not None and page_nums[-1] != page_num:
+                page_nums.append(page_num)
+        found.extend(keys)
+        return True
+
+    def _claim(self, key, page_num, found):
+        """Return True if the image ``key`` has not been read yet and should be now."""
+        if key is None:
+            return True
+        found.append(key)
+        if key in self.seen:
+            self._revisit(key, page_num, [])
+            return False
+        # Mark the image before decoding so a failure is not retried per page.
+        self.seen[key] = None
+        return True
+
+    def _report(self, key, name, page_num, metadata):
+        if not has_image_metadata(metadata):
+            return
+        image = ImageRecord(_key(name), [page_num], {_key(k): v for k, v in metadata.items()})
+        self.images.append(image)
+        if key is not None:
+            self.seen[key] = image.pages
+
+
+def collect_images(pages, pdf_path, limits=None, inline_images=False, first_hit=False):
+    """Return an ImageRecord for every image with metadata reachable from ``pages``.
+
+    Each indirect image is decoded once per document; an image reused on several
+    pages (letterheads, templates) is reported once with the list of those pages.
+    ``first_hit`` stops after the first image with metadata.
+    """
+    walker = ImageWalker(pdf_path, limits or FileLimits(), inline_images, first_hit)
+    try:
+        for page_num, page in enumerate(pages, start=1):
+            if walker.done:
+                break
+            count("pages")
+            walker.walk_page(page, page_num)
+    except Exception as e:
+        logging.warning(f"Could not scan images in {pdf_path}: {e}")
+    return walker.images
+
+
+def read_xmp_record(record, data, xmp_packet=False):
+    """Fill a record's XMP fields from the raw /Metadata stream bytes."""
+    if data is None:
+        return
+    record.xmp = parse_xmp(data, record.path)
+    if xmp_packet:
+        record.xmp_packet = bytes(data).decode("utf-8", errors="replace")
+
+
+def map_file(pdf_path):
+    """Return a read-only memory map of ``pdf_path``.
+
+    Only the pages a parser actually touches are faulted in, straight from the page cache.
+    """
+    with open(pdf_path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ExtractOptions(NamedTuple):
+    """What to read from each document, including documents embedded in it."""
+
+    inline_images: bool = False
+    xmp_packet: bool = False
+    only: tuple = EXTRACT_STAGES
+    first_hit: bool = False
+    attachment_depth: int = 0
+    max_attachment_bytes: int | None = None
+
+
+DEFAULT_ATTACHMENT_DEPTH = 2
+DEFAULT_MAX_ATTACHMENT_BYTES = 64 * 1024 * 1024
+NAME_TREE_MAX_DEPTH = 32
+
+
+def _name_tree_items(node, depth=0):
+    """Yield ``(key, value)`` pairs of a PDF name tree, e.g. /Names /EmbeddedFiles."""
+    node = _resolve(node)
+    names = _resolve(node.get("/Names"))
+    if _is_array(names):
+        for index in range(0, len(names) - 1, 2):
+            yield str(_resolve(names[index])), names[index + 1]
+    kids = _resolve(node.get("/Kids"))
+    # The depth cap also ends malformed trees whose kids point back at an ancestor.
+    if _is_array(kids) and depth < NAME_TREE_MAX_DEPTH:
+        for kid in kids:
+            yield from _name_tree_items(kid, depth + 1)
+
+
+def _attachment_specs(root, pages):
+    """Yield ``(key, source, filespec)`` for embedded files and file-attachment annotations."""
+    names = _resolve(root.get("/Names"))
+    embedded = names.get("/EmbeddedFiles") if names else None
+    if embedded is not None:
+        for key, spec in _name_tree_items(embedded):
+            yield key, "/EmbeddedFiles", spec
+    for page_num, page in enumerate(pages, start=1):
+        if "/Annots" not in page:
+            continue
+        annots = _resolve(page.get("/Annots"))
+        if not _is_array(annots):
+            continue
+        for index, annot_ref in enumerate(annots):
+            annot = _resolve(annot_ref)
+            if str(annot.get("/Subtype")) == "/FileAttachment" and "/FS" in annot:
+                yield f"Annot{index}", f"Page {page_num}", annot.get("/FS")
+
+
+def _attachment_stream(spec):
+    """Return ``(filename, stream reference)`` of a file specification's embedded file."""
+    spec = _resolve(spec)
+    if _is_stream(spec) or not hasattr(spec, "get"):
+        return None, None
+    name = spec.get("/UF") or spec.get("/F")
+    embedded = _resolve(spec.get("/EF"))
+    if not embedded:
+        return (str(name) if name is not None else None), None
+    stream_ref = embedded.get("/UF") or embedded.get("/F")
+    return (str(name) if name is not None else None), stream_ref
+
+
+def read_attachment_data(stream, limits, max_bytes):
+    """Decode an embedded file, or return None if it is larger than ``max_bytes``.
+
+    The declared /Params /Size is checked first. A lying or missing size is caught while
+    decoding: plain Flate streams stop inflating at ``max_bytes``, other filter chains are
+    decoded in full before their size is checked. What is decoded counts towards the whole
+    document's decoded-bytes budget.
+    """
+    params = _resolve(stream.get("/Params"))
+    declared = params.get("/Size") if params else None
+    if max_bytes is not None and declared is not None and int(declared) > max_bytes:
+        return None
+    budget = FileLimits(max_bytes)
+    try:
+        data = read_stream(stream, budget)
+    except DecodeLimitExceeded:
+        return None
+    limits.charge(len(data))
+    return data
+
+
+def read_attachment_metadata(data):
+    """Return metadata of an embedded image file, or None if it is not a readable image."""
+    if data[:2] == b"\xff\xd8":
+        return read_jpeg_metadata(data)
+    if data[:12] == b"\x00\x00\x00\x0cjP  \r\n\x87\n":
+        return read_jp2_metadata(data)
+    try:
+        # Only the header is parsed; pixel data is never decoded.
+        return _pil_metadata(Image.open(io.BytesIO(data)))
+    except Exception:
+        return None
+
+
+def collect_attachments(root, pages, pdf_path, limits, options, depth, read_document):
+    """Return AttachmentRecords for the files attached to a document, read in memory.
+
+    Embedded PDFs are opened from their bytes with ``read_document(data, record, depth)``
+    and described by a nested DocumentRecord whose path is ``parent::name``; embedded
+    images get their metadata read. Attachments of attachments are followed down to
+    ``options.attachment_depth`` levels.
+    """
+    attachments = []
+    seen = set()
+    try:
+        for key, source, spec in _attachment_specs(root, pages):
+            if options.first_hit and attachments:
+                break
+            name, stream_ref = _attachment_stream(spec)
+            name = name or key
+            entry = AttachmentRecord(name, source)
+            try:
+                stream = _resolve(stream_ref)
+                if not _is_stream(stream):
+                    continue
+                object_id = _object_id(stream_ref, stream)
+                if object_id is not None:
+                    if object_id in seen:
+                        continue
+                    seen.add(object_id)
+                attachments.append(entry)
+                count("attachments")
+                data = read_attachment_data(stream, limits, options.max_attachment_bytes)
+                if data is None:
+                    entry.skipped = f"larger than {options.max_attachment_bytes} bytes"
+                    continue
+                entry.size = len(data)
+                count("attachment_bytes", len(data))
+                if b"%PDF-" in data[:1024]:
+                    entry.document = DocumentRecord(f"{pdf_path}::{name}")
+                    read_document(data, entry.document, depth + 1)
+                else:
+                    metadata = read_attachment_metadata(data)
+                    if has_image_metadata(metadata):
+                        entry.metadata = {_key(k): v for k, v in metadata.items()}
+            except Exception as e:
+                logging.warning(f"Could not read attachment {name} in {pdf_path}: {e}")
+    except Exception as e:
+        logging.warning(f"Could not list attachments in {pdf_path}: {e}")
+    return attachments
+
+
+def read_pikepdf_document(pdf, record, limits, options, depth=0):
+    """Fill ``record`` from an open pikepdf document ``depth`` attachments deep."""
+    pdf_path = record.path
+    xmp = None
+    try:
+        with stage("docinfo"):
+            if "docinfo" in options.only:
+                record.docinfo = _docinfo_fields(dict(pdf.docinfo))
+            if "xmp" in options.only and not (options.first_hit and record.has_metadata()):
+                metadata = pdf.Root.get("/Metadata")
+                if metadata is not None:
+                    xmp = read_stream(metadata, limits)
+    except Exception as e:
+        logging.warning(f"Could not extract PDF metadata from {pdf_path}: {e}")
+    with stage("xmp"):
+        read_xmp_record(record, xmp, options.xmp_packet)
+    if "images" in options.only and not (options.first_hit and record.has_metadata()):
+        with stage("images"):
+            pages = (page.obj for page in pdf.pages)
+            record.images = collect_images(
+                pages, pdf_path, limits, options.inline_images, options.first_hit
+            )
+    if depth < options.attachment_depth and not (options.first_hit and record.has_metadata()):
+
+        def read_document(data, document, depth):
+            with pikepdf.open(io.BytesIO(data)) as attached:
+                read_pikepdf_document(attached, document, limits, options, depth)
+
+        with stage("attachments"):
+            pages = (page.obj for page in pdf.pages)
+            record.attachments = collect_attachments(
+                pdf.Root, pages, pdf_path, limits, options, depth, read_document
+            )
+
+
+def read_pypdf_document(reader, record, limits, options, depth=0):
+    """Fill ``record`` from a pypdf reader ``depth`` attachments deep."""
+    pdf_path = record.path
+    xmp = None
+    try:
+        with stage("docinfo"):
+            if "docinfo" in options.only:
+                info = reader.trailer.get("/Info")
+                record.docinfo = _docinfo_fields(dict(_resolve(info)) if info else {})
+            if "xmp" in options.only and not (options.first_hit and record.has_metadata()):
+                metadata = reader.trailer["/Root"].get("/Metadata")
+                if metadata is not None:
+                    xmp = read_stream(_resolve(metadata), limits)
+    except Exception as e:
+        logging.warning(f"Could not extract PDF metadata from {pdf_path}: {e}")
+    with stage("xmp"):
+        read_xmp_record(record, xmp, options.xmp_packet)
+    if "images" in options.only and not (options.first_hit and record.has_metadata()):
+        with stage("images"):
+            record.images = collect_images(
+                reader.pages, pdf_path, limits, options.inline_images, options.first_hit
+            )
+    if depth < options.attachment_depth and not (options.first_hit and record.has_metadata()):
+
+        def read_document(data, document, depth):
+            attached = pypdf.PdfReader(io.BytesIO(data))
+            read_pypdf_document(attached, document, limits, options, depth)
+
+        with stage("attachments"):
+            root = _resolve(reader.trailer["/Root"])
+            record.attachments = collect_attachments(
+                root, reader.pages, pdf_path, limits, options, depth, read_document
+            )
+
+
+def extract_with_pikepdf(pdf_path, limits=None, options=None, use_mmap=False):
+    """Extract docinfo, XMP, image and attachment metadata from a single pikepdf open."""
+    limits = limits or FileLimits()
+    record = DocumentRecord(pdf_path)
+    try:
+        with stage("open"):
+            if use_mmap:
+                # qpdf maps the file itself and parses objects in place; it falls back to
+                # buffered reads when the file cannot be mapped.
+                pdf = pikepdf.open(pdf_path, access_mode=pikepdf.AccessMode.mmap)
+            else:
+                pdf = pikepdf.open(pdf_path)
+    except Exception as e:
+        logging.warning(f"Could not extract PDF metadata from {pdf_path}: {e}")
+        return record
+
+    with pdf:
+        limits.check_pages(pdf.pages, pdf_path)
+        read_pikepdf_document(pdf, record, limits, options or ExtractOptions())
+    return record
+
+
+def extract_with_pypdf(pdf_path, limits=None, options=None, use_mmap=False):
+    """Extract docinfo, XMP, image and attachment metadata from a single pypdf parse."""
+    limits = limits or FileLimits()
+    record = DocumentRecord(pdf_path)
+    with ExitStack() as stack:
+        try:
+            with stage("open"):
+                source = stack.enter_context(map_file(pdf_path)) if use_mmap else pdf_path
+                reader = pypdf.PdfReader(source)
+        except Exception as e:
+            logging.warning(f"Could not extract PDF metadata from {pdf_path}: {e}")
+            return record
+
+        limits.check_pages(reader.pages, pdf_path)
+        read_pypdf_document(reader, record, limits, options or ExtractOptions())
+    return record
+
+
+def render_text(record, out):
+    pdf_path = record.path
+    if record.duplicates:
+        print(f"[Duplicates] {pdf_path}", file=out)
+        for duplicate in record.duplicates:
+            print(f"    {duplicate}", file=out)
+    if record.skipped:
+        print(f"[Skipped] {pdf_path}: {record.skipped}", file=out)
+    print_docinfo(record.docinfo, pdf_path, out)
+    print_xmp_properties(record.xmp, record.xmp_packet, pdf_path, out)
+    for image in record.images:
+        print_image_metadata(image, pdf_path, out)
+    for attachment in record.attachments:
+        print_attachment(attachment, pdf_path, out)
+
+
+def print_attachment(attachment, pdf_path, out):
+    size = "" if attachment.size is None else f" ({attachment.size} bytes)"
+    print(f"[Attachment] {pdf_path} - {attachment.source} - {attachment.name}{size}", file=out)
+    if attachment.skipped:
+        print(f"    skipped: {attachment.skipped}", file=out)
+    for key, val in attachment.metadata.items():
+        print(f"    {key}: {val}", file=out)
+    if attachment.document is not None:
+        render_text(attachment.document, out)
+
+
+def write_record(record, out):
+    """Send a record to a RecordWriter, or render it as text onto a plain stream."""
+    if isinstance(out, RecordWriter):
+        out.write(record)
+    else:
+        render_text(record, out)
+
+
+def process_pdf(
+    pdf_path,
+    out=None,
+    backend=DEFAULT_BACKEND,
+    file_timeout=None,
+    max_decoded_bytes=None,
+    max_pages=None,
+    inline_images=False,
+    xmp_packet=False,
+    use_mmap=False,
+    only=None,
+    first_hit=False,
+    min_pages=None,
+    attachment_depth=0,
+    max_attachment_bytes=DEFAULT_MAX_ATTACHMENT_BYTES,
+):
+    """Extract one PDF, write it to ``out`` (if given) and return its record.
+
+    A file that exceeds ``file_timeout`` seconds, ``max_decoded_bytes`` or ``max_pages``
+    is abandoned and comes back as an otherwise empty record with ``skipped`` set; one
+    with fewer than ``min_pages`` pages is dropped and None is returned.
+    ``inline_images`` additionally decodes every content stream to find inline JPEGs, and
+    ``xmp_packet`` keeps the raw XMP packet alongside its parsed properties. ``use_mmap``
+    has the parser read the file through a memory map instead of buffered I/O. ``only``
+    restricts extraction to some of EXTRACT_STAGES, and ``first_hit`` stops at the first
+    stage (or image) that finds any metadata. With ``attachment_depth`` > 0, embedded files
+    up to ``max_attachment_bytes`` are read as well, recursing into attached PDFs.
+    """
+    logging.info(f"Processing: {pdf_path}")
+    extract = extract_with_pypdf if backend == "pypdf" else extract_with_pikepdf
+    if file_timeout:
+        # An import cut short by the alarm would leave a half-executed module behind for
+        # every later file in this process, so the parsers are loaded before it is armed.
+        _load_now(pypdf if backend == "pypdf" else pikepdf, Image, ET)
+    try:
+        with deadline(file_timeout):
+            limits = FileLimits(max_decoded_bytes, max_pages, min_pages)
+            options = ExtractOptions(
+                inline_images,
+                xmp_packet,
+                only or EXTRACT_STAGES,
+                first_hit,
+                attachment_depth,
+                max_attachment_bytes,
+            )
+            record = extract(pdf_path, limits, options, use_mmap)
+    except FileFiltered as e:
+        logging.info(f"Filtered out {pdf_path}: {e}")
+        count("filtered")
+        return None
+    except FileSkipped as e:
+        logging.warning(f"Skipped {pdf_path}: {e}")
+        count("skipped")
+        record = DocumentRecord(pdf_path, skipped=str(e))
+    if out is not None:
+        write_record(record, out)
+    return record
+
+
+class FileResult(NamedTuple):
+    """Everything a scan produced for one PDF, replayed by the parent in order."""
+
+    path: str
+    record: DocumentRecord | None
+    logs: list
+    error: str | None = None
+    stats: dict | None = None
+
+
+class _LogCapture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+def _init_worker(level):
+    # Forked workers inherit the parent's handlers; drop them so the parent remains
+    # the only writer of the log file.
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+
+def scan_file(pdf_path, process_options):
+    """Run process_pdf on one file and return its record and log records as a FileResult.
+
+    Log records are captured rather than emitted; write_result replays them.
+    """
+    root = logging.getLogger()
+    capture = _LogCapture()
+    handlers, root.handlers = root.handlers, [capture]
+    record = None
+    error = None
+    try:
+        with track_file(pdf_path) as file_stats:
+            record = process_pdf(pdf_path, **process_options)
+    except Exception as e:
+        error = str(e)
+        logging.error(f"Failed to process {pdf_path}: {e}")
+    finally:
+        root.handlers = handlers
+    return FileResult(pdf_path, record, capture.records, error, file_stats.as_dict())
+
+
+def _new_pool(jobs):
+    return process_pool.ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(logging.getLogger().level,)
+    )
+
+
+def _scan_isolated(pdf_path, process_options):
+    # Re-run a file that was in flight when the pool died in a pool of its own, so a
+    # single crashing PDF is identified and recorded instead of failing its neighbours.
+    try:
+        with _new_pool(1) as pool:
+            return pool.submit(scan_file, pdf_path, process_options).result()
+    except process_pool.BrokenProcessPool as e:
+        message = f"Worker crashed while processing {pdf_path}: {e}"
+        return FileResult(pdf_path, None, [(logging.ERROR, message)], "worker crashed")
+
+
+def scan_parallel(pdf_files, jobs, process_options, ordered=True, lookup=None):
+    """Scan ``pdf_files`` in ``jobs`` worker processes, yielding a FileResult per file.
+
+    Results come back in input order unless ``ordered`` is false, in which case they
+    are yielded as soon as each file completes. At most a few files per worker are
+    queued (or waiting to be written in order) at any time. ``lookup`` may return a
+    ready-made FileResult for a path (e.g. from a ResultCache) to skip scanning it.
+    """
+    window = jobs * 4
+    todo = iter(enumerate(pdf_files))
+    finished = {}
+    next_index = 0
+    submitted = 0
+    exhausted = False
+
+    def ready():
+        nonlocal next_index
+        if not ordered:
+            yield from finished.values()
+            finished.clear()
+            return
+        while next_index in finished:
+            yield finished.pop(next_index)
+            next_index += 1
+
+    while not exhausted or submitted > next_index:
+        inflight = {}
+        crashed = []
+        with _new_pool(jobs) as pool:
+            while True:
+                while not exhausted and len(inflight) + len(finished) < window:
+                    item = next(todo, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    submitted += 1
+                    cached = lookup(item[1]) if lookup else None
+                    if cached is not None:
+                        finished[item[0]] = cached
+                        yield from ready()
+                        continue
+                    inflight[pool.submit(scan_file, item[1], process_options)] = item
+                if not inflight:
+                    break
+
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, pdf_path = inflight.pop(future)
+                    try:
+                        finished[index] = future.result()
+                    except process_pool.BrokenProcessPool:
+                        crashed.append((index, pdf_path))
+                if crashed:
+                    # The pool is unusable now; every remaining future fails the same way.
+                    for future, (index, pdf_path) in inflight.items():
+                        try:
+                            finished[index] = future.result()
+                        except process_pool.BrokenProcessPool:
+                            crashed.append((index, pdf_path))
+                    break
+                yield from ready()
+
+        for index, pdf_path in sorted(crashed):
+            finished[index] = _scan_isolated(pdf_path, process_options)
+        yield from ready()
+        if not ordered:
+            next_index = submitted
+
+
+def scan_serial(pdf_files, process_options, lookup=None):
+    for pdf_path in pdf_files:
+        cached = lookup(pdf_path) if lookup else None
+        yield cached if cached is not None else scan_file(pdf_path, process_options)
+
+
+def write_result(result, out):
+    for level, message in result.logs:
+        logging.log(level, message)
+    if result.record is not None:
+        write_record(result.record, out)
+
+
+CACHE_VERSION = 9
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+class Deduplicator:
+    """Find files with identical content so that each content is scanned only once.
 
-    logging.basicConfig(
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        level=logging.INFO if verbose else logging.WARNING,
-        handlers=handlers,
+    Candidates are narrowed in three passes, each only over files that still collide:
+    equal size, then a hash of the first and last ``BLOCK_SIZE`` bytes, then a hash of
+    the whole file. The first path of each content (in discovery order) is scanned, and
+    its record lists the other paths under ``duplicates``.
+    """
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self):
+        self.duplicates = {}
+        self.files = 0
+        self.bytes = 0
+
+    def unique(self, pdf_paths):
+        """Return the paths to scan: one per distinct content, in discovery order."""
+        pdf_paths = list(pdf_paths)
+        by_size = {}
+        for pdf_path in pdf_paths:
+            try:
+                size = os.stat(pdf_path).st_size
+            except OSError:
+                continue  # unreadable files are scanned so the scan reports them
+            by_size.setdefault(size, []).append(pdf_path)
+        for size, paths in by_size.items():
+            if len(paths) < 2:
+                continue
+            for same_head_tail in self._group(paths, partial(self._partial_digest, size=size)):
+                if size <= 2 * self.BLOCK_SIZE:
+                    self._record(same_head_tail, size)  # the partial hash covered every byte
+                    continue
+                for same_content in self._group(same_head_tail, file_digest):
+                    self._record(same_content, size)
+        dropped = {path for paths in self.duplicates.values() for path in paths}
+        return [pdf_path for pdf_path in pdf_paths if pdf_path not in dropped]
+
+    def _group(self, paths, digest):
+        groups = {}
+        for pdf_path in paths:
+            try:
+                groups.setdefault(digest(pdf_path), []).append(pdf_path)
+            except OSError as e:
+                logging.warning(f"Could not hash {pdf_path} for deduplication: {e}")
+        return [group for group in groups.values() if len(group) > 1]
+
+    def _partial_digest(self, pdf_path, size):
+        digest = hashlib.blake2b()
+        with open(pdf_path, "rb") as f:
+            digest.update(f.read(self.BLOCK_SIZE))
+            if size > self.BLOCK_SIZE:
+                f.seek(max(size - self.BLOCK_SIZE, self.BLOCK_SIZE))
+                digest.update(f.read(self.BLOCK_SIZE))
+        return digest.digest()
+
+    def _record(self, paths, size):
+        first, *rest = paths
+        self.duplicates[first] = rest
+        self.files += len(rest)
+        self.bytes += size * len(rest)
+
+    def annotate(self, result):
+        """Return ``result`` with the other paths of its content added to its record."""
+        others = self.duplicates.get(result.path)
+        if not others or result.record is None:
+            return result
+        record = copy.copy(result.record)
+        record.duplicates = others
+        return result._replace(record=record)
+
+    def summary(self):
+        return (
+            f"Skipped {self.files} duplicate files ({self.bytes} bytes) of "
+            f"{len(self.duplicates)} contents found more than once"
+        )
+
+
+class ResultCache:
+    """SQLite store of scan results keyed by path and (size, mtime, inode) signature.
+
+    With ``hash_contents`` a file also matches when its size and content digest are
+    unchanged, so touched or copied-in-place files are still replayed. Results only
+    match when they were produced with the same ``options``.
+    """
+
+    COMMIT_EVERY = 500
+
+    def __init__(self, path, options=None, rebuild=False, hash_contents=False):
+        self.options = json.dumps(options or {}, sort_keys=True)
+        self.hash_contents = hash_contents
+        self.scan_id = time.time_ns()
+        self._pending = {}
+        self._writes = 0
+        self.hits = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if rebuild or version != CACHE_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS results")
+            self.conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                inode INTEGER,
+                digest TEXT,
+                options TEXT,
+                record TEXT,
+                logs TEXT,
+                scan_id INTEGER
+            )""")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _matches(self, row, signature):
+        size, mtime_ns, inode, digest = signature
+        if self.hash_contents:
+            return row[0] == size and row[3] == digest
+        return row[:3] == (size, mtime_ns, inode)
+
+    def lookup(self, pdf_path):
+        """Return the cached FileResult for an unchanged file, or None."""
+        try:
+            st = os.stat(pdf_path)
+            digest = file_digest(pdf_path) if self.hash_contents else None
+        except OSError as e:
+            logging.warning(f"Could not stat {pdf_path} for the cache: {e}")
+            return None
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino, digest)
+
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, digest, record, logs FROM results"
+            " WHERE path = ? AND options = ?",
+            (pdf_path, self.options),
+        ).fetchone()
+        if row and self._matches(row, signature):
+            self.hits += 1
+            self._write("UPDATE results SET scan_id = ? WHERE path = ?", (self.scan_id, pdf_path))
+            logging.info(f"Unchanged, replaying from cache: {pdf_path}")
+            logs = [tuple(log) for log in json.loads(row[5])]
+            record = json.loads(row[4])
+            if record is not None:
+                record = DocumentRecord.from_dict(record)
+            return FileResult(pdf_path, record, logs)
+
+        # Remember the signature taken *before* scanning so a file modified mid-scan
+        # is not recorded as matching its newer stat.
+        self._pending[pdf_path] = signature
+        return None
+
+    def store(self, result):
+        signature = self._pending.pop(result.path, None)
+        # Failed and skipped files are retried next time: timeouts depend on load, limits
+        # may change. A file dropped by --min-pages is stored without a record.
+        if signature is None or result.error is not None:
+            return
+        if result.record is not None and result.record.skipped:
+            return
+        record = result.record.as_dict() if result.record is not None else None
+        logs = [log for log in result.logs if log[0] >= logging.WARNING]
+        self._write(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                result.path,
+                *signature,
+                self.options,
+                json.dumps(record),
+                json.dumps(logs),
+                self.scan_id,
+            ),
+        )
+
+    def evict_missing(self, folder):
+        """Drop entries under ``folder`` for files that no longer exist.
+
+        Only entries this scan did not see are checked, so files it left out on purpose
+        (other shards, pre-filters, duplicates) keep theirs.
+        """
+        prefix = os.path.join(folder, "")
+        rows = self.conn.execute(
+            "SELECT path FROM results WHERE scan_id != ? AND substr(path, 1, ?) = ?",
+            (self.scan_id, len(prefix), prefix),
+        ).fetchall()
+        vanished = [row for row in rows if not os.path.exists(row[0])]
+        self.conn.executemany("DELETE FROM results WHERE path = ?", vanished)
+        self.conn.commit()
+        if vanished:
+            logging.info(f"Evicted {len(vanished)} vanished files from the cache")
+        return len(vanished)
+
+    def _write(self, sql, params):
+        self.conn.execute(sql, params)
+        self._writes += 1
+        if self._writes % self.COMMIT_EVERY == 0:
+            self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+OUTPUT_FORMATS = ("text", "jsonl", "csv", "parquet")
+OUTPUT_BUFFER_SIZE = 1 << 20
+# Characters of rendered records a RecordWriter collects before writing them out.
+OUTPUT_BATCH_SIZE = 1 << 18
+RECORD_FIELDS = (
+    "path",
+    "duplicates",
+    "docinfo",
+    "xmp",
+    "xmp_packet",
+    "images",
+    "attachments",
+    "skipped",
+)
+
+
+class RecordWriter(abc.ABC):
+    """Streaming writer for output records; ``write`` takes one document record.
+
+    Subclasses render each document into a single string and pass it to ``_emit``, which
+    collects them and writes to the stream once ``batch_size`` characters have built up,
+    so a scan of many small files makes a few large writes instead of one per line.
+    """
+
+    def __init__(self, stream, batch_size=OUTPUT_BATCH_SIZE):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @abc.abstractmethod
+    def write(self, record):
+        """Render one DocumentRecord into the output."""
+
+    def _emit(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.batch_size:
+            self._drain()
+
+    def _drain(self):
+        if self.pending:
+            self.stream.write("".join(self.pending))
+            self.pending.clear()
+            self.pending_size = 0
+
+    def flush(self):
+        self._drain()
+        self.stream.flush()
+
+    def close(self):
+        self._drain()
+        self.stream.close()
+
+
+class TextWriter(RecordWriter):
+    """The human-readable report written by render_text."""
+
+    def write(self, record):
+        buffer = io.StringIO()
+        render_text(record, buffer)
+        self._emit(buffer.getvalue())
+
+
+class JsonlWriter(RecordWriter):
+    def write(self, record):
+        self._emit(json.dumps(record.as_dict(), ensure_ascii=False) + "\n")
+
+
+class _RowSink(NamedTuple):
+    write: Callable[[str], None]
+
+
+class CsvWriter(RecordWriter):
+    """One row per document; nested fields (docinfo, xmp, images, ...) are JSON-encoded."""
+
+    def __init__(self, stream, batch_size=OUTPUT_BATCH_SIZE, header=True):
+        super().__init__(stream, batch_size)
+        # csv.writer only needs a ``write``; each row it formats goes straight into the batch.
+        self.writer = csv.writer(_RowSink(self._emit))
+        if header:
+            self.writer.writerow(RECORD_FIELDS)
+
+    def write(self, record):
+        data = record.as_dict()
+        self.writer.writerow(
+            [
+                data["path"],
+                json.dumps(data["duplicates"], ensure_ascii=False),
+                json.dumps(data["docinfo"], ensure_ascii=False),
+                json.dumps(data["xmp"], ensure_ascii=False),
+                data["xmp_packet"] or "",
+                json.dumps(data["images"], ensure_ascii=False),
+                json.dumps(data["attachments"], ensure_ascii=False),
+                data["skipped"] or "",
+            ]
+        )
+
+
+def _json_map(mapping):
+    # Values keep their JSON type (``jfif: 257`` stays a number) as in the other formats.
+    return [(key, json.dumps(_plain(value), ensure_ascii=False)) for key, value in mapping.items()]
+
+
+class ParquetWriter(RecordWriter):
+    """Buffer records and write them as one Parquet row group per ``batch_size`` documents.
+
+    Docinfo, XMP and image metadata are maps from key to the JSON encoding of the value.
+    Attachments nest records inside records, which Parquet cannot express, so that column
+    holds the JSON encoding used by the csv format.
+    """
+
+    def __init__(self, path, batch_size=10_000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(open(path, "wb"), batch_size)
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                ("path", pa.string()),
+                ("duplicates", pa.list_(pa.string())),
+                ("docinfo", pa.map_(pa.string(), pa.string())),
+                ("xmp", pa.map_(pa.string(), pa.string())),
+                ("xmp_packet", pa.string()),
+                (
+                    "images",
+                    pa.list_(
+                        pa.struct(
+                            [
+                                ("name", pa.string()),
+                                ("pages", pa.list_(pa.int32())),
+                                ("metadata", pa.map_(pa.string(), pa.string())),
+                            ]
+                        )
+                    ),
+                ),
+                ("attachments", pa.string()),
+                ("skipped", pa.string()),
+            ]
+        )
+        self.writer = pq.ParquetWriter(self.stream, self.schema)
+
+    def write(self, record):
+        attachments = [attachment.as_dict() for attachment in record.attachments]
+        self.pending.append(
+            {
+                "path": record.path,
+                "duplicates": record.duplicates,
+                "docinfo": _json_map(record.docinfo),
+                "xmp": _json_map(record.xmp),
+                "xmp_packet": record.xmp_packet,
+                "images": [
+                    {
+                        "name": image.name,
+                        "pages": image.pages,
+                        "metadata": _json_map(image.metadata),
+                    }
+                    for image in record.images
+                ],
+                "attachments": json.dumps(attachments, ensure_ascii=False),
+                "skipped": record.skipped,
+            }
+        )
+        if len(self.pending) >= self.batch_size:
+            self._drain()
+
+    def _drain(self):
+        if self.pending:
+            self.writer.write_table(self.pa.Table.from_pylist(self.pending, schema=self.schema))
+            self.pending.clear()
+
+    def close(self):
+        self._drain()
+        self.writer.close()
+        self.stream.close()
+
+
+def open_output(path, output_format="text", append=False):
+    """Open ``path`` for results with the RecordWriter for ``output_format``.
+
+    With ``append`` new records go after those already in the file (not for parquet).
+    """
+    if output_format == "parquet":
+        return ParquetWriter(path)
+    newline = "" if output_format == "csv" else None
+    mode = "a" if append else "w"
+    stream = open(path, mode, encoding="utf-8", newline=newline, buffering=OUTPUT_BUFFER_SIZE)
+    if output_format == "jsonl":
+        return JsonlWriter(stream)
+    if output_format == "csv":
+        return CsvWriter(stream, header=stream.tell() == 0)
+    return TextWriter(stream)
+
+
+CHECKPOINT_INTERVAL = 10.0
+JOURNAL_SUFFIX = ".journal"
+
+
+class Checkpoint:
+    """Journal of the files a scan has finished, so an interrupted scan can resume.
+
+    Every ``interval`` seconds the output is flushed and synced to disk, then one JSON
+    line ``{"offset": <output size>, "paths": [...]}`` naming the files finished since the
+    previous line is appended to the journal and synced too. The journal therefore never
+    claims output that is not on disk; records written after its last line (and a last
+    line cut short by a crash) are discarded by ``resume``.
+    """
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.finished = set()
+        self.out = None
+        self.journal = None
+        self.pending = []
+        self.last_commit = time.monotonic()
+
+    def resume(self, out_path):
+        """Load the journal and cut ``out_path`` back to its last checkpoint.
+
+        Returns True if there is earlier output to append to, False to start afresh.
+        """
+        offset = None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # the line being written when the scan was killed
+                    self.finished.update(entry["paths"])
+                    offset = entry["offset"]
+        except FileNotFoundError:
+            logging.warning(f"No checkpoint journal at {self.path}, scanning from the start")
+            return False
+        if offset is None:
+            return False
+        try:
+            os.truncate(out_path, offset)
+        except OSError as e:
+            logging.warning(f"Cannot resume into {out_path}, starting afresh: {e}")
+            self.finished.clear()
+            return False
+        logging.info(f"Resuming after {len(self.finished)} files recorded in {self.path}")
+        return True
+
+    def start(self, out, append=False):
+        """Begin journaling results written to the RecordWriter ``out``."""
+        self.out = out
+        self.journal = open(self.path, "a" if append else "w", encoding="utf-8")
+        self.last_commit = time.monotonic()
+
+    def done(self, pdf_path):
+        """Note that everything for ``pdf_path`` has been handed to the output."""
+        self.pending.append(pdf_path)
+        if time.monotonic() - self.last_commit >= self.interval:
+            self.commit()
+
+    def commit(self):
+        self.last_commit = time.monotonic()
+        if not self.pending or self.journal is None:
+            return
+        self.out.flush()
+        fd = self.out.stream.fileno()
+        os.fsync(fd)
+        entry = {"offset": os.fstat(fd).st_size, "paths": self.pending}
+        self.journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.pending = []
+
+    def close(self, complete=False):
+        """Write a last checkpoint; a ``complete`` scan needs no journal, so it is removed."""
+        if self.journal is None:
+            return
+        self.commit()
+        self.journal.close()
+        self.journal = None
+        if complete:
+            os.remove(self.path)
+
+
+def iter_pdf_files(folder):
+    """Yield PDF paths under ``folder`` as they are found, in os.walk's top-down order."""
+    stack = [folder]
+    while stack:
+        directory = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(".pdf"):
+                        yield entry.path
+        except OSError as e:
+            logging.warning(f"Could not list {directory}: {e}")
+        stack.extend(reversed(subdirs))
+
+
+def parse_shard(spec):
+    """Parse ``K/N`` (1 <= K <= N) into a ``(K, N)`` tuple."""
+    try:
+        k, n = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {spec!r}") from None
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(f"shard {spec!r} needs 1 <= K <= N")
+    return k, n
+
+
+def in_shard(pdf_path, folder, shard):
+    """True if ``pdf_path`` belongs to shard ``(K, N)`` of ``folder``.
+
+    The hash is taken over the path relative to ``folder``, so machines that mount the
+    same share at different places still agree on the partition.
+    """
+    k, n = shard
+    relative = os.path.relpath(pdf_path, folder).encode("utf-8", errors="surrogateescape")
+    digest = hashlib.blake2b(relative, digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n == k - 1
+
+
+class PathFilter:
+    """Pre-filters on a discovered file's path and size, checked before it is opened.
+
+    ``globs`` are fnmatch patterns matched against the path relative to the scanned
+    folder (``*`` also matches ``/``); a file is kept if it matches any of them.
+    """
+
+    def __init__(self, globs=None, min_size=None, max_size=None):
+        self.globs = tuple(globs or ())
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def matches(self, pdf_path, folder):
+        if self.globs:
+            relative = os.path.relpath(pdf_path, folder)
+            if not any(fnmatch.fnmatchcase(relative, pattern) for pattern in self.globs):
+                return False
+        if self.min_size is None and self.max_size is None:
+            return True
+        try:
+            size = os.stat(pdf_path).st_size
+        except OSError:
+            return True  # let the scan report it
+        if self.min_size is not None and size < self.min_size:
+            return False
+        return self.max_size is None or size <= self.max_size
+
+
+def iter_selected_files(folder, shard=None, path_filter=None):
+    """Yield the PDFs under ``folder`` in one ``(K, N)`` shard that pass ``path_filter``."""
+    for pdf_path in iter_pdf_files(folder):
+        if shard is not None and not in_shard(pdf_path, folder, shard):
+            continue
+        if path_filter is None or path_filter.matches(pdf_path, folder):
+            yield pdf_path
+
+
+def count_pdf_files(folder, shard=None, path_filter=None):
+    return sum(1 for _ in iter_selected_files(folder, shard, path_filter))
+
+
+def scan_folder(
+    folder,
+    out,
+    show_progress=False,
+    jobs=1,
+    ordered=True,
+    prefetch_count=False,
+    cache=None,
+    stats=None,
+    shard=None,
+    path_filter=None,
+    dedup=None,
+    checkpoint=None,
+    **process_options,
+):
+    pdf_files = iter_selected_files(folder, shard, path_filter)
+    # Without a prefetch pass the total is unknown and tqdm shows an open-ended counter.
+    total = (
+        count_pdf_files(folder, shard, path_filter) if show_progress and prefetch_count else None
     )
+    if dedup is not None:
+        # Deduplication has to see every file first, which also gives the total for free.
+        pdf_files = dedup.unique(pdf_files)
+        total = len(pdf_files)
+        if stats is not None:
+            stats.counters["duplicate_files"] = dedup.files
+            stats.counters["duplicate_bytes"] = dedup.bytes
+    if checkpoint is not None and checkpoint.finished:
+        finished = checkpoint.finished
+        pdf_files = (pdf_path for pdf_path in pdf_files if pdf_path not in finished)
+        if total is not None:
+            total = max(total - len(finished), 0)
+
+    if jobs <= 1 and cache is None and dedup is None:
+        iterator = (
+            tqdm.tqdm(pdf_files, total=total, desc="Scanning PDFs") if show_progress else pdf_files
+        )
+        for pdf_path in iterator:
+            if stats is None:
+                process_pdf(pdf_path, out, **process_options)
+            else:
+                with track_file(pdf_path) as file_stats:
+                    process_pdf(pdf_path, out, **process_options)
+                stats.add(file_stats.as_dict())
+            if checkpoint is not None:
+                checkpoint.done(pdf_path)
+        return
+
+    lookup = cache.lookup if cache is not None else None
+    if jobs > 1:
+        results = scan_parallel(pdf_files, jobs, process_options, ordered=ordered, lookup=lookup)
+    else:
+        results = scan_serial(pdf_files, process_options, lookup=lookup)
+    if show_progress:
+        results = tqdm.tqdm(results, total=total, desc="Scanning PDFs")
+    for result in results:
+        # The cache keeps the record as scanned; duplicates depend on the rest of the tree.
+        write_result(dedup.annotate(result) if dedup is not None else result, out)
+        if checkpoint is not None:
+            checkpoint.done(result.path)
+        if cache is not None:
+            cache.store(result)
+        if stats is not None:
+            stats.add(result.stats, failed=result.error is not None)
+
+    if cache is not None:
+        cache.evict_missing(folder)
+
+
+class ScanService:
+    """Scan PDFs submitted over time in a worker pool, writing each result as it finishes.
+
+    Paths wait in a bounded queue: ``submit`` blocks while it is full, which pushes back
+    on whoever is feeding paths in. ``jobs`` worker processes do the extraction and each
+    result is written and flushed to ``out`` (a text stream or line-oriented
+    RecordWriter) as soon as its file is done. Use as ``async with``; leaving the block
+    drains the queue and shuts the pool down.
+    """
+
+    def __init__(self, out, jobs=1, process_options=None, queue_size=None, cache=None, stats=None):
+        self.out = out
+        self.jobs = jobs
+        self.process_options = process_options or {}
+        self.queue = asyncio.Queue(queue_size or jobs * 4)
+        self.cache = cache
+        self.stats = stats
+        self.pool = None
+        self.workers = []
+
+    async def __aenter__(self):
+        self.pool = _new_pool(self.jobs)
+        self.workers = [asyncio.create_task(self._work()) for _ in range(self.jobs)]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.drain()
+
+    async def submit(self, pdf_path):
+        """Queue one PDF, waiting while the queue is full."""
+        await self.queue.put(pdf_path)
+
+    async def submit_tree(self, path):
+        """Queue ``path``, or every PDF under it if it is a folder; return how many."""
+        if not os.path.isdir(path):
+            await self.submit(path)
+            return 1
+        queued = 0
+        for pdf_path in iter_pdf_files(path):
+            await self.submit(pdf_path)
+            queued += 1
+        return queued
 
+    async def drain(self):
+        """Finish every queued file, then stop the workers and the pool."""
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
 
-def extract_pdf_metadata(pdf_path, out):
+    async def _work(self):
+        while True:
+            pdf_path = await self.queue.get()
+            try:
+                self._write(await self._scan(pdf_path))
+            except Exception as e:
+                logging.error(f"Could not scan {pdf_path}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _scan(self, pdf_path):
+        cached = self.cache.lookup(pdf_path) if self.cache is not None else None
+        if cached is not None:
+            return cached
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            return await loop.run_in_executor(pool, scan_file, pdf_path, self.process_options)
+        except process_pool.BrokenProcessPool:
+            # Every file in flight fails with the pool: the first worker to notice replaces
+            # it, and each of those files is retried alone to find the one that crashed.
+            if self.pool is pool:
+                pool.shutdown(wait=False)
+                self.pool = _new_pool(self.jobs)
+            return await loop.run_in_executor(None, _scan_isolated, pdf_path, self.process_options)
+
+    def _write(self, result):
+        write_result(result, self.out)
+        self.out.flush()
+        if self.cache is not None:
+            self.cache.store(result)
+        if self.stats is not None:
+            self.stats.add(result.stats, failed=result.error is not None)
+
+
+async def _feed(service, reader, writer=None):
+    # One path per line; a folder queues every PDF beneath it.
+    while line := await reader.readline():
+        path = line.decode("utf-8", errors="surrogateescape").strip()
+        if not path:
+            continue
+        queued = await service.submit_tree(path)
+        if writer is not None:
+            writer.write(f"queued {queued} {path}\n".encode("utf-8", errors="surrogateescape"))
+            await writer.drain()
+
+
+async def _stdin_reader():
+    reader = asyncio.StreamReader()
     try:
-        with pikepdf.open(pdf_path) as pdf:
-            docinfo = dict(pdf.docinfo)
-            if docinfo:
-                print(f"[PDF Metadata] {pdf_path}", file=out)
-                for key, value in docinfo.items():
-                    print(f"    {key}: {value}", file=out)
-            return pdf.open_metadata()
-    except Exception as e:
-        logging.warning(f"Could not extract PDF metadata from {pdf_path}: {e}")
-        return None
+        await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+        )
+    except ValueError:
+        # A regular file redirected to stdin cannot be watched by the event loop.
+        reader.feed_data(sys.stdin.buffer.read())
+        reader.feed_eof()
+    return reader
 
 
-def extract_xmp_rdf(xmp_metadata, pdf_path, out):
-    if not xmp_metadata:
+async def serve(address, service, stop=None):
+    """Feed paths, one per line, to ``service`` until ``stop`` is set.
+
+    ``address`` is the path of a Unix socket to listen on; each client gets a
+    ``queued N PATH`` line back per path once it is queued, and is disconnected when
+    serving stops. With ``"-"`` paths are read
+    from stdin instead, and serving also ends at end of input.
+    """
+    stop = stop or asyncio.Event()
+    if address == "-":
+        feed = asyncio.create_task(_feed(service, await _stdin_reader()))
+        stopped = asyncio.create_task(stop.wait())
+        await asyncio.wait({feed, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        for task in (feed, stopped):
+            task.cancel()
         return
+
+    clients = {}
+
+    async def handle_client(reader, writer):
+        clients[writer] = asyncio.current_task()
+        try:
+            await _feed(service, reader, writer)
+        finally:
+            writer.close()
+            del clients[writer]
+
+    server = await asyncio.start_unix_server(handle_client, path=address)
     try:
-        xml_str = str(xmp_metadata)
-        print(f"[XMP Metadata] {pdf_path}", file=out)
-        print(xml_str, file=out)
+        async with server:
+            await stop.wait()
+        # Hang up on connected clients; lines they already sent are still queued.
+        handlers = list(clients.values())
+        for writer in list(clients):
+            writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+    finally:
+        if os.path.exists(address):
+            os.unlink(address)
 
-        root = ET.fromstring(xml_str)
-        for rdf in root.findall(".//{http://www.w3.org/1999/02/22-rdf-syntax-ns#}RDF"):
-            print(f"[RDF Metadata] {pdf_path}", file=out)
-            print(ET.tostring(rdf, encoding="unicode"), file=out)
-    except Exception as e:
-        logging.warning(f"Failed to parse XMP/RDF in {pdf_path}: {e}")
 
+# inotify(7) event bits
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct("iIII")
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+class _Inotify:
+    """Minimal ctypes binding to Linux inotify, watching every folder of a tree."""
+
+    MASK = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.dirs = {}
+
+    @classmethod
+    def open(cls, folder):
+        """Return a watch on ``folder`` and its subfolders, or None without inotify."""
+        if not sys.platform.startswith("linux"):
+            return None
+        import ctypes.util
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        inotify = cls(libc, fd)
+        try:
+            inotify.add_tree(folder)
+        except OSError as e:
+            logging.warning(f"Cannot watch {folder} with inotify, polling instead: {e}")
+            inotify.close()
+            return None
+        return inotify
+
+    def add_tree(self, folder):
+        for directory, _, _ in os.walk(folder):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), directory)
+            self.dirs[wd] = directory
 
-def extract_image_metadata(pdf_path, out):
+    def read(self):
+        """Yield ``(path, mask)`` for the pending events; path is None on queue overflow."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size
+            name = data[pos : pos + length].rstrip(b"\0")
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                yield None, mask
+            elif mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            elif wd in self.dirs:
+                yield os.path.join(self.dirs[wd], os.fsdecode(name)), mask
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _signature(path):
     try:
-        reader = PdfReader(pdf_path)
-        for page_num, page in enumerate(reader.pages):
-            xobjects = page.get("/Resources", {}).get("/XObject", None)
-            if not xobjects:
-                continue
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
 
-            try:
-                xobjects = xobjects.get_object()
-            except Exception:
+
+class FolderWatcher:
+    """Report PDFs under ``folder`` that are created or changed, once they stop changing.
+
+    Uses inotify where available; elsewhere, or when ``poll_interval`` is given, the
+    tree is walked every ``poll_interval`` seconds and compared by size and mtime. A
+    file is reported only after its size and mtime have been stable for ``settle``
+    seconds, so PDFs still being copied in are not scanned half-written, and only if
+    they differ from what was last reported (or found by ``start``).
+    """
+
+    def __init__(self, folder, settle=2.0, poll_interval=None):
+        self.folder = folder
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.inotify = None
+        # path -> (size, mtime_ns) present at start or last reported
+        self.known = {}
+        # path -> [(size, mtime_ns), monotonic time it last changed]
+        self.pending = {}
+        self.last_poll = 0.0
+
+    def start(self):
+        """Begin watching; the PDFs already in the folder are not reported."""
+        if self.poll_interval is None:
+            self.inotify = _Inotify.open(self.folder)
+            if self.inotify is None:
+                self.poll_interval = DEFAULT_POLL_INTERVAL
+        self._poll(report=False)
+
+    def touch(self, path):
+        entry = self.pending.setdefault(path, [None, 0.0])
+        entry[1] = time.monotonic()
+
+    async def changes(self, stop):
+        """Yield settled new or changed PDF paths until ``stop`` is set."""
+        loop = asyncio.get_running_loop()
+        if self.inotify is not None:
+            loop.add_reader(self.inotify.fd, self._read_events)
+        tick = max(min(self.settle, self.poll_interval or self.settle) / 2, 0.01)
+        try:
+            while not stop.is_set():
+                with suppress(TimeoutError):
+                    await asyncio.wait_for(stop.wait(), tick)
+                if self.inotify is None and time.monotonic() - self.last_poll >= self.poll_interval:
+                    self._poll()
+                for path in self._settled():
+                    yield path
+        finally:
+            if self.inotify is not None:
+                loop.remove_reader(self.inotify.fd)
+                self.inotify.close()
+                self.inotify = None
+
+    def _poll(self, report=True):
+        seen = set()
+        for path in iter_pdf_files(self.folder):
+            signature = _signature(path)
+            if signature is None:
                 continue
+            seen.add(path)
+            if not report:
+                self.known[path] = signature
+            elif path not in self.pending and self.known.get(path) != signature:
+                # Pending files are already re-checked on every tick by _settled.
+                self.touch(path)
+        for path in self.known.keys() - seen:
+            del self.known[path]
+        self.last_poll = time.monotonic()
 
-            for name, obj_ref in xobjects.items():
-                try:
-                    obj = obj_ref.get_object()
-                    if obj.get("/Subtype") != "/Image":
-                        continue
+    def _read_events(self):
+        try:
+            for path, mask in self.inotify.read():
+                if path is None:
+                    logging.warning(f"inotify queue overflowed, rescanning {self.folder}")
+                    self._poll()
+                elif mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.inotify.add_tree(path)
+                        for pdf_path in iter_pdf_files(path):
+                            self.touch(pdf_path)
+                elif not path.lower().endswith(".pdf"):
+                    continue
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.known.pop(path, None)
+                else:
+                    self.touch(path)
+        except OSError as e:
+            logging.warning(f"Cannot watch {self.folder} with inotify, polling instead: {e}")
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+            self.poll_interval = self.poll_interval or DEFAULT_POLL_INTERVAL
 
-                    filters = obj.get("/Filter")
-                    if filters:
-                        if isinstance(filters, list):
-                            filters = [str(f) for f in filters]
-                        else:
-                            filters = [str(filters)]
+    def _settled(self):
+        now = time.monotonic()
+        for path, entry in list(self.pending.items()):
+            signature = _signature(path)
+            if signature is None:
+                del self.pending[path]
+            elif signature != entry[0]:
+                entry[0], entry[1] = signature, now
+            elif now - entry[1] >= self.settle:
+                del self.pending[path]
+                if self.known.get(path) != signature:
+                    self.known[path] = signature
+                    yield path
 
-                        if any(f in ["/CCITTFaxDecode", "/JBIG2Decode"] for f in filters):
-                            continue
 
-                    data = obj.get_data()
-                    img = Image.open(io.BytesIO(data))
-
-                    metadata = img.info or {}
-                    if hasattr(img, "getexif"):
-                        exif = img.getexif()
-                        if exif:
-                            metadata.update(exif)
-
-                    keys_to_ignore = {
-                        "jfif",
-                        "jfif_version",
-                        "jfif_unit",
-                        "jfif_density",
-                        "dpi",
-                        "adobe",
-                        "adobe_transform",
-                    }
-                    if metadata and any(key not in keys_to_ignore for key in metadata.keys()):
-                        print(
-                            f"[Image Metadata] {pdf_path} - Page {page_num + 1} - {name}", file=out
-                        )
-                        for key, val in metadata.items():
-                            print(f"    {key}: {val}", file=out)
-                except Exception as e:
-                    logging.warning(f"Error reading image {name} in {pdf_path}: {e}")
-    except Exception as e:
-        logging.warning(f"Could not scan images in {pdf_path}: {e}")
+async def watch(folder, service, stop, settle=2.0, poll_interval=None, path_filter=None):
+    """Scan ``folder`` with ``service``, then keep scanning PDFs added or changed in it."""
+    watcher = FolderWatcher(folder, settle, poll_interval)
+    # Watch before the initial scan so nothing written during it is missed.
+    watcher.start()
+    for pdf_path in iter_selected_files(folder, path_filter=path_filter):
+        await service.submit(pdf_path)
+    logging.info(f"Watching {folder} for new or changed PDFs")
+    async for pdf_path in watcher.changes(stop):
+        if path_filter is None or path_filter.matches(pdf_path, folder):
+            await service.submit(pdf_path)
 
 
-def process_pdf(pdf_path, out):
-    logging.info(f"Processing: {pdf_path}")
-    xmp = extract_pdf_metadata(pdf_path, out)
-    extract_xmp_rdf(xmp, pdf_path, out)
-    extract_image_metadata(pdf_path, out)
+async def run_service(feed, out, jobs=1, process_options=None, cache=None, stats=None):
+    """Run a ScanService fed by ``feed(service, stop)`` until SIGINT/SIGTERM, then drain.
+
+    ``feed`` may also return on its own, e.g. ``serve`` at the end of stdin.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    async with ScanService(out, jobs, process_options, cache=cache, stats=stats) as service:
+        await feed(service, stop)
+    logging.info("Scan service stopped")
+
+
+MERGE_FORMATS = {".jsonl": "jsonl", ".csv": "csv", ".parquet": "parquet"}
+MERGE_RUN_SIZE = 100_000
+# csv's default field limit (128 KiB) is smaller than a large XMP packet or image list;
+# 2**31 - 1 is the highest limit a C long holds on every platform.
+CSV_FIELD_SIZE_LIMIT = 2**31 - 1
 
 
-def scan_folder(folder, out, show_progress=False):
-    pdf_files = []
-    for root, _, files in os.walk(folder):
-        for f in files:
-            if f.lower().endswith(".pdf"):
-                pdf_files.append(os.path.join(root, f))
+def _pairs_to_dict(pairs):
+    # pyarrow hands Parquet map columns back as lists of (key, JSON value) tuples.
+    return {key: json.loads(value) for key, value in pairs} if pairs is not None else {}
 
-    iterator = tqdm(pdf_files, desc="Scanning PDFs") if show_progress else pdf_files
-    for pdf_path in iterator:
-        process_pdf(pdf_path, out)
+
+def read_records(path):
+    """Yield the document records of a jsonl, csv or parquet output file."""
+    output_format = MERGE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if output_format == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif output_format == "csv":
+        csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                yield {
+                    "path": row["path"],
+                    "duplicates": json.loads(row.get("duplicates") or "[]"),
+                    "docinfo": json.loads(row["docinfo"]),
+                    "xmp": json.loads(row["xmp"]),
+                    "xmp_packet": row["xmp_packet"] or None,
+                    "images": json.loads(row["images"]),
+                    "attachments": json.loads(row.get("attachments") or "[]"),
+                    "skipped": row["skipped"] or None,
+                }
+    elif output_format == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches():
+            for record in batch.to_pylist():
+                record["docinfo"] = _pairs_to_dict(record["docinfo"])
+                record["xmp"] = _pairs_to_dict(record["xmp"])
+                for image in record["images"]:
+                    image["metadata"] = _pairs_to_dict(image["metadata"])
+                record["attachments"] = json.loads(record.get("attachments") or "[]")
+                record.setdefault("duplicates", [])
+                yield record
+    else:
+        raise ValueError(f"cannot merge {path}: expected a .jsonl, .csv or .parquet file")
+
+
+def sorted_records(paths, run_size=MERGE_RUN_SIZE):
+    """Yield the records of all ``paths`` sorted by document path.
+
+    Records are sorted in runs of ``run_size`` that are spilled to temporary JSON-lines
+    files and then merged, so outputs larger than memory can be combined.
+    """
+    key = itemgetter("path")
+    with tempfile.TemporaryDirectory(prefix="pdfscan-merge-") as tmp:
+        runs = []
+        chunk = []
+        for path in paths:
+            for record in read_records(path):
+                chunk.append(record)
+                if len(chunk) >= run_size:
+                    runs.append(_spill(sorted(chunk, key=key), tmp, len(runs)))
+                    chunk = []
+        if not runs:
+            yield from sorted(chunk, key=key)
+            return
+        runs.append(_spill(sorted(chunk, key=key), tmp, len(runs)))
+        files = [open(run, encoding="utf-8") for run in runs]
+        try:
+            yield from heapq.merge(*(map(json.loads, f) for f in files), key=key)
+        finally:
+            for f in files:
+                f.close()
+
+
+def _spill(records, directory, index):
+    path = os.path.join(directory, f"run{index}.jsonl")
+    with open(path, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE) as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+    return path
+
+
+def merge_outputs(paths, out):
+    """Write the records of per-shard outputs to ``out`` in path order; return the count.
+
+    A path found in more than one input is written once.
+    """
+    written = 0
+    previous = None
+    for record in sorted_records(paths):
+        if record["path"] == previous:
+            logging.warning(f"Duplicate record for {previous} in merged outputs")
+            continue
+        previous = record["path"]
+        write_record(DocumentRecord.from_dict(record), out)
+        written += 1
+    return written
+
+
+def merge_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="pdfscan merge",
+        description="Combine per-shard outputs (and stats) into one result sorted by path.",
+    )
+    parser.add_argument("inputs", nargs="+", help="shard outputs (.jsonl, .csv or .parquet)")
+    parser.add_argument("-o", "--out", required=True, help="merged output file")
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=OUTPUT_FORMATS,
+        help="output format (default: from the --out extension, else the first input's)",
+    )
+    parser.add_argument(
+        "--stats", nargs="+", default=[], metavar="JSON", help="shard --stats-json files"
+    )
+    parser.add_argument(
+        "--stats-json", metavar="PATH", help="write the combined stats snapshot to PATH"
+    )
+    parser.add_argument(
+        "--stats-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="number of slowest files kept in the combined stats (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    for path in args.inputs:
+        if os.path.splitext(path)[1].lower() not in MERGE_FORMATS:
+            parser.error(f"cannot merge {path}: expected a .jsonl, .csv or .parquet file")
+    output_format = (
+        args.format
+        or MERGE_FORMATS.get(os.path.splitext(args.out)[1].lower())
+        or MERGE_FORMATS[os.path.splitext(args.inputs[0])[1].lower()]
+    )
+    needs_pyarrow = output_format == "parquet" or any(p.endswith(".parquet") for p in args.inputs)
+    if needs_pyarrow and importlib.util.find_spec("pyarrow") is None:
+        parser.error("parquet files require pyarrow (pip install pyarrow)")
+
+    with open_output(args.out, output_format) as out:
+        written = merge_outputs(args.inputs, out)
+    print(
+        f"Merged {written} records from {len(args.inputs)} files into {args.out}", file=sys.stderr
+    )
+
+    if args.stats:
+        snapshots = []
+        for path in args.stats:
+            with open(path, encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        stats = ScanStats.from_snapshots(snapshots, args.stats_top)
+        print(stats.summary(), file=sys.stderr)
+        if args.stats_json:
+            write_stats_json(stats, args.stats_json)
+
+
+def write_stats_json(stats, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(stats.snapshot(), f, ensure_ascii=False)
 
 
 def main():
+    if sys.argv[1:2] == ["merge"]:
+        merge_main(sys.argv[2:])
+        return
     parser = argparse.ArgumentParser(description="Extract metadata from PDFs.")
-    parser.add_argument("folder", help="folder to scan recursively")
+    parser.add_argument("folder", nargs="?", help="folder to scan recursively")
     parser.add_argument(
         "-l", "--log", default="scanner.log", help="log file path (warnings/errors)"
     )
@@ -146,12 +2816,301 @@ def main():
     parser.add_argument(
         "-p", "--progress", action="store_true", help="show a live progress bar while scanning PDFs"
     )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=DEFAULT_BACKEND,
+        help="PDF parser used to read each file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--inline-images",
+        action="store_true",
+        help="also decode page and form content streams to read inline JPEG images",
+    )
+    parser.add_argument(
+        "--xmp-packet",
+        action="store_true",
+        help="also output the raw XMP packet, not just its parsed properties",
+    )
+    parser.add_argument(
+        "--attachments",
+        action="store_true",
+        help="also read embedded files and file attachments, recursing into attached PDFs",
+    )
+    parser.add_argument(
+        "--attachment-depth",
+        type=int,
+        default=DEFAULT_ATTACHMENT_DEPTH,
+        metavar="N",
+        help="with --attachments, how many levels of attachments to follow "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-attachment-bytes",
+        type=int,
+        default=DEFAULT_MAX_ATTACHMENT_BYTES,
+        metavar="N",
+        help="with --attachments, skip attachments larger than N bytes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="read each PDF through a memory map, so only the parts parsed are paged in",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes (0 = one per CPU, default: %(default)s)",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="with --jobs, write results as files finish instead of in input order",
+    )
+    parser.add_argument(
+        "--prefetch-count",
+        action="store_true",
+        help="count PDFs before scanning so the progress bar can show an ETA",
+    )
+    parser.add_argument(
+        "--cache", metavar="PATH", help="SQLite file used to skip unchanged files on rescans"
+    )
+    parser.add_argument(
+        "--rebuild-cache", action="store_true", help="discard the cache contents before scanning"
+    )
+    parser.add_argument(
+        "--cache-hash",
+        action="store_true",
+        help="match cached files by size and content hash instead of mtime/inode",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="output format, one record per document for jsonl/csv/parquet (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print per-stage timings, throughput and the slowest files to stderr at the end",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        metavar="SECONDS",
+        help="print a JSON stats line to stderr every SECONDS (implies --stats)",
+    )
+    parser.add_argument(
+        "--stats-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="number of slowest files listed by --stats (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stats-json",
+        metavar="PATH",
+        help="also write the final stats as JSON to PATH, e.g. for pdfscan merge "
+        "(implies --stats)",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="scan each distinct file content once and list the other paths that share it",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="K/N",
+        help="scan only the K-th of N disjoint slices of the folder (by path hash)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"continue an interrupted scan: skip the files listed in OUT{JOURNAL_SUFFIX} "
+        "and append to --out",
+    )
+    parser.add_argument(
+        "--file-timeout",
+        type=float,
+        metavar="SECONDS",
+        help="abandon a file that takes longer than SECONDS and record it as skipped",
+    )
+    parser.add_argument(
+        "--max-decoded-bytes",
+        type=int,
+        metavar="N",
+        help="abandon a file once more than N bytes of stream data have been decoded",
+    )
+    parser.add_argument(
+        "--max-pages",
+        type=int,
+        metavar="N",
+        help="skip files with more than N pages",
+    )
+    parser.add_argument(
+        "--min-pages",
+        type=int,
+        metavar="N",
+        help="leave files with fewer than N pages out of the output",
+    )
+    parser.add_argument(
+        "--only",
+        type=parse_stages,
+        metavar="STAGES",
+        help="comma-separated stages to run: docinfo, xmp, images (default: all)",
+    )
+    parser.add_argument(
+        "--first-hit",
+        action="store_true",
+        help="stop reading a file at the first docinfo entry, XMP property or image metadata",
+    )
+    parser.add_argument(
+        "--glob",
+        action="append",
+        metavar="PATTERN",
+        help="only scan files whose path relative to the folder matches PATTERN (repeatable)",
+    )
+    parser.add_argument("--min-size", type=int, metavar="BYTES", help="skip smaller files")
+    parser.add_argument("--max-size", type=int, metavar="BYTES", help="skip larger files")
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="run as a service scanning paths sent one per line to the Unix socket SOCKET "
+        "(or stdin with '-') until SIGINT/SIGTERM",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="after scanning the folder, keep scanning PDFs that are added or changed in it",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="with --watch, wait until a file is unchanged for SECONDS (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        metavar="SECONDS",
+        help="with --watch, poll mtimes every SECONDS instead of using inotify",
+    )
     args = parser.parse_args()
+    if (args.folder is None) == (args.serve is None):
+        parser.error("give either a folder to scan or --serve SOCKET")
+    if args.watch and args.serve:
+        parser.error("--watch takes a folder and cannot be combined with --serve")
+    if (args.shard or args.dedup or args.resume) and (args.serve or args.watch):
+        parser.error("--shard, --dedup and --resume only apply to a one-off folder scan")
+    if args.resume and args.format == "parquet":
+        parser.error("--resume cannot append to parquet output")
+    if args.resume and os.path.exists(args.out) and not os.path.isfile(args.out):
+        parser.error("--resume needs --out to be a regular file")
+    path_filter = None
+    if args.glob or args.min_size is not None or args.max_size is not None:
+        if args.serve:
+            parser.error("--glob, --min-size and --max-size need a folder, not --serve")
+        path_filter = PathFilter(args.glob, args.min_size, args.max_size)
+    if (args.serve or args.watch) and args.format == "parquet":
+        parser.error("--serve/--watch write each result as it finishes and cannot write parquet")
+    if (args.rebuild_cache or args.cache_hash) and not args.cache:
+        parser.error("--rebuild-cache and --cache-hash require --cache")
+    if args.format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        parser.error("--format parquet requires pyarrow (pip install pyarrow)")
 
-    setup_logger(args.log, verbose=args.verbose)
+    setup_logger(args.log, verbose=args.verbose, append=args.resume)
 
-    with open(args.out, "w", encoding="utf-8") as metadata_out:
-        scan_folder(args.folder, metadata_out, show_progress=args.progress)
+    process_options = {
+        "backend": args.backend,
+        "file_timeout": args.file_timeout,
+        "max_decoded_bytes": args.max_decoded_bytes,
+        "max_pages": args.max_pages,
+        "inline_images": args.inline_images,
+        "xmp_packet": args.xmp_packet,
+        "use_mmap": args.mmap,
+        "only": args.only,
+        "first_hit": args.first_hit,
+        "min_pages": args.min_pages,
+        "attachment_depth": args.attachment_depth if args.attachments else 0,
+        "max_attachment_bytes": args.max_attachment_bytes,
+    }
+    cache = None
+    if args.cache:
+        # How the file is read does not change its record, so --mmap shares cache entries.
+        cache_options = {k: v for k, v in process_options.items() if k != "use_mmap"}
+        cache = ResultCache(
+            args.cache,
+            options=cache_options,
+            rebuild=args.rebuild_cache,
+            hash_contents=args.cache_hash,
+        )
+
+    stats = None
+    if args.stats or args.stats_interval or args.stats_json:
+        stats = ScanStats(args.stats_top, args.stats_interval)
+
+    dedup = Deduplicator() if args.dedup else None
+    checkpoint = None
+    append = False
+    # Only a regular file can be synced and cut back to a checkpoint; not e.g. /dev/null.
+    regular_output = os.path.isfile(args.out) or not os.path.exists(args.out)
+    if not (args.serve or args.watch or args.format == "parquet") and regular_output:
+        checkpoint = Checkpoint(f"{args.out}{JOURNAL_SUFFIX}")
+        if args.resume:
+            append = checkpoint.resume(args.out)
+    jobs = args.jobs or os.cpu_count() or 1
+    try:
+        with open_output(args.out, args.format, append=append) as metadata_out:
+            if args.serve or args.watch:
+                if args.serve:
+                    feed = partial(serve, args.serve)
+                else:
+                    feed = partial(
+                        watch,
+                        args.folder,
+                        settle=args.settle,
+                        poll_interval=args.poll_interval,
+                        path_filter=path_filter,
+                    )
+                asyncio.run(run_service(feed, metadata_out, jobs, process_options, cache, stats))
+            else:
+                complete = False
+                if checkpoint is not None:
+                    checkpoint.start(metadata_out, append)
+                try:
+                    scan_folder(
+                        args.folder,
+                        metadata_out,
+                        show_progress=args.progress,
+                        jobs=jobs,
+                        ordered=not args.unordered,
+                        prefetch_count=args.prefetch_count,
+                        cache=cache,
+                        stats=stats,
+                        shard=args.shard,
+                        path_filter=path_filter,
+                        dedup=dedup,
+                        checkpoint=checkpoint,
+                        **process_options,
+                    )
+                    complete = True
+                finally:
+                    if checkpoint is not None:
+                        checkpoint.close(complete)
+        if dedup is not None:
+            print(dedup.summary(), file=sys.stderr)
+        if stats is not None:
+            print(stats.summary(), file=sys.stderr)
+            if args.stats_json:
+                write_stats_json(stats, args.stats_json)
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == "__main__":
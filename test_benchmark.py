@@ -0,0 +1,57 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+import benchmark
+
+TINY_CORPUS = {name: 1 for name in benchmark.CORPUS_COUNTS}
+
+
+def digests(root):
+    result = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.endswith(".pdf"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    result[name] = hashlib.sha256(f.read()).hexdigest()
+    return result
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_corpus_is_reproducible(self):
+        first = os.path.join(self.tmp.name, "first")
+        second = os.path.join(self.tmp.name, "second")
+        manifest = benchmark.generate_corpus(first, seed=7, counts=TINY_CORPUS)
+        benchmark.generate_corpus(second, seed=7, counts=TINY_CORPUS)
+        self.assertEqual(set(manifest["files"]), set(benchmark.GENERATORS))
+        self.assertEqual(len(digests(first)), len(benchmark.GENERATORS))
+        self.assertEqual(digests(first), digests(second))
+
+    def test_run_and_compare(self):
+        corpus = os.path.join(self.tmp.name, "corpus")
+        benchmark.generate_corpus(corpus, counts=TINY_CORPUS)
+        result = benchmark.run_benchmark(corpus, repeat=1)
+        self.assertEqual(result["results"]["files"], len(benchmark.GENERATORS))
+        self.assertGreater(result["results"]["files_per_sec"], 0)
+        self.assertIn("images", result["results"]["stages"])
+
+        lines = benchmark.compare(result, result)
+        self.assertIn("+0.0%", lines[1])
+
+    def test_startup_leaves_backends_unloaded(self):
+        result = benchmark.startup_benchmark(repeat=1)
+        self.assertEqual(result["results"]["eager_modules"], [])
+        self.assertGreater(result["results"]["import_us"], 0)
+        lines = benchmark.compare(result, result)
+        self.assertEqual(
+            [line.split()[0] for line in lines[1:]], ["import_wall", "help_wall", "import_us"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
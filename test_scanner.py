@@ -1,45 +1,115 @@
+import argparse
+import asyncio
+import csv
+import importlib.util
+import json
 import logging
 import os
+import pickle
+import shutil
+import signal
+import subprocess
+import sys
 import tempfile
+import time
 import unittest
+from contextlib import redirect_stderr
 from io import BytesIO, StringIO
 from unittest.mock import MagicMock, patch
 
+import pikepdf
 from PIL import Image, PngImagePlugin
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, EncodedStreamObject, NameObject
 
 import scanner
 
 
-class TestScanner(unittest.TestCase):
-    @patch("pikepdf.open")
-    def test_extract_pdf_metadata(self, mock_pikepdf_open):
-        mock_pdf = MagicMock()
-        mock_pdf.docinfo = {"/Title": "Test Title", "/Author": "Test Author"}
-        mock_pdf.open_metadata.return_value = "<x:xmpmeta></x:xmpmeta>"
-        mock_pikepdf_open.return_value.__enter__.return_value = mock_pdf
+def jpeg_with_make(make):
+    img = Image.new("RGB", (8, 8), color="red")
+    exif = img.getexif()
+    exif[0x010F] = make
+    bio = BytesIO()
+    img.save(bio, format="JPEG", exif=exif)
+    return bio.getvalue()
+
+
+def make_pdf(path, docinfo=None, exif_make=None, pages=1):
+    """Write a small real PDF, optionally with a JPEG carrying an EXIF Make tag."""
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    if docinfo:
+        for key, value in docinfo.items():
+            pdf.docinfo[key] = value
+    if exif_make:
+        image = pikepdf.Stream(
+            pdf,
+            jpeg_with_make(exif_make),
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Image,
+            Width=8,
+            Height=8,
+            ColorSpace=pikepdf.Name.DeviceRGB,
+            BitsPerComponent=8,
+            Filter=pikepdf.Name.DCTDecode,
+        )
+        for page in pdf.pages:
+            page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image))
+    pdf.save(path)
+    return path
 
-        out = StringIO()
-        xmp = scanner.extract_pdf_metadata("dummy.pdf", out)
 
-        self.assertIn("[PDF Metadata]", out.getvalue())
-        self.assertIn("Test Title", out.getvalue())
-        self.assertEqual(xmp, "<x:xmpmeta></x:xmpmeta>")
+class TempDirTestCase(unittest.TestCase):
+    """Gives each test a temporary directory, ``self.tmp``, removed afterwards."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_docs(self, count, folder=None):
+        """Write ``count`` PDFs titled T0, T1, ... into ``folder`` (by default ``tmp/docs``)."""
+        self.folder = folder or os.path.join(self.tmp.name, "docs")
+        os.makedirs(self.folder, exist_ok=True)
+        self.paths = [
+            make_pdf(os.path.join(self.folder, f"doc{i}.pdf"), docinfo={"/Title": f"T{i}"})
+            for i in range(count)
+        ]
+        return self.paths
 
-    def test_extract_xmp_rdf_valid(self):
-        xmp = """<x:xmpmeta xmlns:x='adobe:ns:meta/'>
+
+def print_images(pages, pdf_path, out):
+    for image in scanner.collect_images(pages, pdf_path):
+        scanner.print_image_metadata(image, pdf_path, out)
+
+
+class TestScanner(unittest.TestCase):
+    def test_process_pdf_prints_docinfo(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf(
+                os.path.join(tmp, "doc.pdf"),
+                docinfo={"/Title": "Test Title", "/Author": "Test Author"},
+            )
+            out = StringIO()
+            record = scanner.process_pdf(pdf_path, out)
+        self.assertIn(f"[PDF Metadata] {pdf_path}", out.getvalue())
+        self.assertIn("/Title: Test Title", out.getvalue())
+        self.assertEqual(record.docinfo["/Author"], "Test Author")
+
+    def test_print_xmp_properties(self):
+        xmp = b"""<x:xmpmeta xmlns:x='adobe:ns:meta/'>
             <rdf:RDF xmlns:rdf='http://www.w3.org/1999/02/22-rdf-syntax-ns#'>
-                <rdf:Description rdf:about=""/>
+                <rdf:Description rdf:about="" xmlns:pdf="http://ns.adobe.com/pdf/1.3/"
+                    pdf:Producer="Writer"/>
             </rdf:RDF>
         </x:xmpmeta>"""
         out = StringIO()
-        scanner.extract_xmp_rdf(xmp, "file.pdf", out)
-        output = out.getvalue()
-        self.assertIn("[XMP Metadata]", output)
-        self.assertIn("[RDF Metadata]", output)
+        properties = scanner.parse_xmp(xmp, "file.pdf")
+        scanner.print_xmp_properties(properties, None, "file.pdf", out)
+        self.assertEqual(out.getvalue(), "[XMP Metadata] file.pdf\n    pdf:Producer: Writer\n")
 
-    @patch("scanner.PdfReader")
     @patch("scanner.Image.open")
-    def test_extract_image_metadata_jpeg(self, mock_image_open, mock_reader):
+    def test_collect_images_jpeg(self, mock_image_open):
         # Fake JPEG data, content doesn't matter since Image.open is mocked
         fake_jpeg_data = b"fakejpegdata"
 
@@ -70,14 +140,14 @@ class TestScanner(unittest.TestCase):
             "/Resources": {"/XObject": xobject_dict_obj}
         }.get(k, default)
 
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("file.pdf", out)
+        print_images(pages, "file.pdf", out)
         assert "[Image Metadata]" in out.getvalue()
 
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_png(self, mock_reader):
+    def test_collect_images_flate_is_not_decoded(self):
+        # Flate images decode to bare pixel samples, which cannot carry metadata
         img = Image.new("RGB", (10, 10), color="blue")
         bio = BytesIO()
         meta = PngImagePlugin.PngInfo()
@@ -105,15 +175,15 @@ class TestScanner(unittest.TestCase):
             "/Resources": {"/XObject": xobject_dict_obj}
         }.get(k, default)
 
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("file.pdf", out)
+        print_images(pages, "file.pdf", out)
 
-        self.assertIn("[Image Metadata]", out.getvalue())
+        image_obj.get_data.assert_not_called()
+        self.assertNotIn("[Image Metadata]", out.getvalue())
 
-    @patch("scanner.PdfReader")
-    def test_invalid_image_data_logs_warning(self, mock_reader):
+    def test_invalid_image_data_logs_warning(self):
         image_obj = MagicMock()
         image_obj.get.side_effect = lambda k, default=None: {
             "/Subtype": "/Image",
@@ -133,17 +203,16 @@ class TestScanner(unittest.TestCase):
             "/Resources": {"/XObject": xobject_dict_obj}
         }.get(k, default)
 
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
         with self.assertLogs(level="WARNING") as cm:
-            scanner.extract_image_metadata("file.pdf", out)
+            print_images(pages, "file.pdf", out)
 
         logs = "\n".join(cm.output)
         self.assertIn("Error reading image", logs)
 
-    @patch("scanner.PdfReader")
-    def test_skip_non_image(self, mock_reader):
+    def test_skip_non_image(self):
         non_image_obj = MagicMock()
         non_image_obj.get.side_effect = lambda k, default=None: {"/Subtype": "/Form"}.get(
             k, default
@@ -154,17 +223,16 @@ class TestScanner(unittest.TestCase):
             "Obj": MagicMock(get_object=lambda: non_image_obj)
         }
 
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("file.pdf", out)
+        print_images(pages, "file.pdf", out)
         self.assertEqual(out.getvalue().strip(), "")
 
-    @patch("scanner.PdfReader")
-    def test_pdf_with_no_pages(self, mock_reader):
-        mock_reader.return_value.pages = []
+    def test_pdf_with_no_pages(self):
+        pages = []
         out = StringIO()
-        scanner.extract_image_metadata("empty.pdf", out)
+        print_images(pages, "empty.pdf", out)
         self.assertEqual(out.getvalue().strip(), "")
 
     def test_setup_logger_writes_log(self):
@@ -187,58 +255,66 @@ class TestScanner(unittest.TestCase):
         finally:
             os.remove(log_path)
 
-    @patch("pikepdf.open")
-    def test_extract_pdf_metadata_empty_docinfo(self, mock_open):
-        mock_pdf = MagicMock()
-        mock_pdf.docinfo = {}
-        mock_pdf.open_metadata.return_value = "<meta/>"
-        mock_open.return_value.__enter__.return_value = mock_pdf
-
-        out = StringIO()
-        result = scanner.extract_pdf_metadata("dummy.pdf", out)
-        self.assertEqual(result, "<meta/>")
+    def test_setup_logger_closes_its_files(self):
+        root = logging.getLogger()
+        saved = root.handlers[:], root.level
+        self.addCleanup(setattr, root, "handlers", saved[0])
+        self.addCleanup(root.setLevel, saved[1])
+        with tempfile.TemporaryDirectory() as tmp:
+            scanner.setup_logger(os.path.join(tmp, "first.log"))
+            (first,) = root.handlers[0].listener.handlers
+            scanner.setup_logger(os.path.join(tmp, "second.log"), verbose=True)
+            self.assertIsNone(first.stream)
+            queue_handler = root.handlers[0]
+            file_handler, stream_handler = queue_handler.listener.handlers
+            queue_handler.close()
+            self.assertIsNone(file_handler.stream)
+            self.assertIs(stream_handler.stream, sys.stdout)
+
+    def test_process_pdf_empty_docinfo(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf(os.path.join(tmp, "doc.pdf"))
+            out = StringIO()
+            record = scanner.process_pdf(pdf_path, out)
+        self.assertEqual(record.docinfo, {})
         self.assertNotIn("[PDF Metadata]", out.getvalue())
 
-    @patch("pikepdf.open", side_effect=Exception("boom"))
-    def test_extract_pdf_metadata_exception(self, _):
-        out = StringIO()
-        result = scanner.extract_pdf_metadata("bad.pdf", out)
-        self.assertIsNone(result)
-
-    def test_extract_xmp_rdf_empty_input(self):
+    @patch("scanner.pikepdf.open", side_effect=Exception("boom"))
+    def test_process_pdf_open_exception(self, _):
         out = StringIO()
-        scanner.extract_xmp_rdf("", "file.pdf", out)
+        with self.assertLogs(level="WARNING") as cm:
+            record = scanner.process_pdf("bad.pdf", out)
+        self.assertEqual(record, scanner.DocumentRecord("bad.pdf"))
         self.assertEqual(out.getvalue(), "")
+        self.assertIn("Could not extract PDF metadata from bad.pdf: boom", "\n".join(cm.output))
 
-    def test_extract_xmp_rdf_invalid_xml(self):
+    def test_empty_xmp_prints_nothing(self):
         out = StringIO()
-        with self.assertLogs(level="WARNING") as cm:
-            scanner.extract_xmp_rdf("<bad><xml>", "file.pdf", out)
-        self.assertIn("Failed to parse XMP/RDF", "\n".join(cm.output))
+        properties = scanner.parse_xmp(b"", "file.pdf")
+        scanner.print_xmp_properties(properties, None, "file.pdf", out)
+        self.assertEqual(properties, {})
+        self.assertEqual(out.getvalue(), "")
 
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_no_xobject(self, mock_reader):
+    def test_collect_images_no_xobject(self):
         page = MagicMock()
         page.get.return_value = {}  # No "/XObject"
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("test.pdf", out)
+        print_images(pages, "test.pdf", out)
         self.assertEqual(out.getvalue().strip(), "")
 
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_xobject_get_object_fails(self, mock_reader):
+    def test_collect_images_xobject_get_object_fails(self):
         page = MagicMock()
         xresources = {"/XObject": MagicMock(get_object=MagicMock(side_effect=Exception("fail")))}
         page.get.return_value = xresources
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("test.pdf", out)
+        print_images(pages, "test.pdf", out)
         self.assertEqual(out.getvalue().strip(), "")
 
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_skipped_filter(self, mock_reader):
+    def test_collect_images_skipped_filter(self):
         image_obj = MagicMock()
         image_obj.get.side_effect = lambda k, default=None: {
             "/Subtype": "/Image",
@@ -257,14 +333,13 @@ class TestScanner(unittest.TestCase):
         page.get.side_effect = lambda k, default=None: {
             "/Resources": {"/XObject": xobject_dict_obj}
         }.get(k, default)
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("test.pdf", out)
+        print_images(pages, "test.pdf", out)
         self.assertEqual(out.getvalue().strip(), "")
 
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_no_metadata(self, mock_reader):
+    def test_collect_images_no_metadata(self):
         img = Image.new("RGB", (10, 10), color="green")
         bio = BytesIO()
         img.save(bio, format="JPEG")
@@ -291,23 +366,34 @@ class TestScanner(unittest.TestCase):
             page.get.side_effect = lambda k, default=None: {
                 "/Resources": {"/XObject": xobject_dict_obj}
             }.get(k, default)
-            mock_reader.return_value.pages = [page]
+            pages = [page]
 
             out = StringIO()
-            scanner.extract_image_metadata("test.pdf", out)
+            print_images(pages, "test.pdf", out)
             self.assertEqual(out.getvalue().strip(), "")
 
-    def test_process_pdf_calls_all_extracts(self):
+    def test_process_pdf_opens_file_once(self):
         with (
-            patch("scanner.extract_pdf_metadata", return_value="xmp") as meta,
-            patch("scanner.extract_xmp_rdf") as xmp,
-            patch("scanner.extract_image_metadata") as img,
+            patch("scanner.pikepdf.open") as pike_open,
+            patch("scanner.pypdf.PdfReader") as reader,
+            patch("scanner.parse_xmp", return_value={}) as xmp,
         ):
             out = StringIO()
             scanner.process_pdf("mock.pdf", out)
-            meta.assert_called_once()
+            pike_open.assert_called_once_with("mock.pdf")
+            reader.assert_not_called()
             xmp.assert_called_once()
-            img.assert_called_once()
+
+    def test_process_pdf_pypdf_backend(self):
+        with (
+            patch("scanner.pikepdf.open") as pike_open,
+            patch("scanner.pypdf.PdfReader") as reader,
+        ):
+            reader.return_value.pages = []
+            out = StringIO()
+            scanner.process_pdf("mock.pdf", out, backend="pypdf")
+            pike_open.assert_not_called()
+            reader.assert_called_once_with("mock.pdf")
 
     def test_scan_folder_processes_pdf_files(self):
         with tempfile.TemporaryDirectory() as tmp:
@@ -323,8 +409,7 @@ class TestScanner(unittest.TestCase):
                 scanner.scan_folder(tmp, out)
                 proc.assert_called_once_with(pdf_path, out)
 
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_no_exif(self, mock_reader):
+    def test_collect_images_no_exif(self):
         # Image with no EXIF or info metadata
         img = Image.new("RGB", (10, 10))
         bio = BytesIO()
@@ -351,17 +436,19 @@ class TestScanner(unittest.TestCase):
             "/Resources": {"/XObject": xobject_dict_obj}
         }.get(k, default)
 
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("file.pdf", out)
+        print_images(pages, "file.pdf", out)
         self.assertNotIn("[Image Metadata]", out.getvalue())
 
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_get_data_exception(self, mock_reader):
+    def test_collect_images_get_data_exception(self):
         # Raise exception from get_data()
         image_obj = MagicMock()
-        image_obj.get.side_effect = lambda k, default=None: {"/Subtype": "/Image"}.get(k, default)
+        image_obj.get.side_effect = lambda k, default=None: {
+            "/Subtype": "/Image",
+            "/Filter": "/DCTDecode",
+        }.get(k, default)
         image_obj.get_data.side_effect = Exception("fail reading data")
 
         image_obj_ref = MagicMock()
@@ -376,38 +463,23 @@ class TestScanner(unittest.TestCase):
             "/Resources": {"/XObject": xobject_dict_obj}
         }.get(k, default)
 
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
         with self.assertLogs(level="WARNING") as cm:
-            scanner.extract_image_metadata("file.pdf", out)
+            print_images(pages, "file.pdf", out)
         logs = "\n".join(cm.output)
         self.assertIn("Error reading image", logs)
 
-    def test_extract_xmp_rdf_missing_elements(self):
-        # Pass minimal/broken XMP metadata
-        broken_xmp = "<x:xmpmeta xmlns:x='adobe:ns:meta/'></x:xmpmeta>"
+    def test_xmp_without_rdf_prints_only_the_packet(self):
+        packet = "<x:xmpmeta xmlns:x='adobe:ns:meta/'></x:xmpmeta>"
         out = StringIO()
-        scanner.extract_xmp_rdf(broken_xmp, "file.pdf", out)
-        self.assertIn("[XMP Metadata]", out.getvalue())
-
-    @patch("pikepdf.open")
-    def test_extract_pdf_metadata_with_metadata(self, mock_open):
-        # Covers lines 84-89 - normal metadata extraction path
-        mock_pdf = MagicMock()
-        mock_pdf.docinfo = {"/Title": "Test Title"}
-        mock_pdf.open_metadata.return_value = "<x:xmpmeta></x:xmpmeta>"
-        mock_open.return_value.__enter__.return_value = mock_pdf
+        properties = scanner.parse_xmp(packet.encode(), "file.pdf")
+        scanner.print_xmp_properties(properties, packet, "file.pdf", out)
+        self.assertEqual(properties, {})
+        self.assertEqual(out.getvalue(), f"[XMP Packet] file.pdf\n{packet}\n")
 
-        out = StringIO()
-        xmp = scanner.extract_pdf_metadata("file.pdf", out)
-        output = out.getvalue()
-        self.assertIn("[PDF Metadata]", output)
-        self.assertIn("Test Title", output)
-        self.assertEqual(xmp, "<x:xmpmeta></x:xmpmeta>")
-
-    @patch("scanner.PdfReader")
-    def test_extract_image_metadata_invalid_xobject(self, mock_reader):
+    def test_collect_images_invalid_xobject(self):
         # Covers lines 125-134 - XObject dict with non-image or missing /Subtype
         non_image_obj = MagicMock()
         non_image_obj.get.side_effect = lambda k, default=None: {"/Subtype": "/Form"}.get(
@@ -426,13 +498,1462 @@ class TestScanner(unittest.TestCase):
             "/Resources": {"/XObject": xobject_dict_obj}
         }.get(k, default)
 
-        mock_reader.return_value.pages = [page]
+        pages = [page]
 
         out = StringIO()
-        scanner.extract_image_metadata("file.pdf", out)
+        print_images(pages, "file.pdf", out)
         # Expect no image metadata printed for non-image subtype
         self.assertEqual(out.getvalue().strip(), "")
 
 
+_scan_file = scanner.scan_file
+
+
+def crash_on_bad_pdf(pdf_path, process_options):
+    # Stands in for scanner.scan_file in worker processes; kills the worker outright.
+    if os.path.basename(pdf_path).startswith("bad"):
+        os._exit(1)
+    return _scan_file(pdf_path, process_options)
+
+
+class TestBackends(unittest.TestCase):
+    def test_backends_report_same_metadata(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf(
+                os.path.join(tmp, "doc.pdf"), docinfo={"/Title": "Report"}, exif_make="Cam"
+            )
+            for backend in scanner.BACKENDS:
+                with self.subTest(backend=backend):
+                    out = StringIO()
+                    scanner.process_pdf(pdf_path, out, backend=backend)
+                    output = out.getvalue()
+                    self.assertIn("[PDF Metadata]", output)
+                    self.assertIn("/Title: Report", output)
+                    self.assertIn(f"[Image Metadata] {pdf_path} - Page 1 - /Im0", output)
+                    self.assertIn("Cam", output)
+
+    def test_mmap_matches_buffered_reads(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf(
+                os.path.join(tmp, "doc.pdf"), docinfo={"/Title": "Report"}, exif_make="Cam"
+            )
+            empty = os.path.join(tmp, "empty.pdf")
+            open(empty, "wb").close()
+            for backend in scanner.BACKENDS:
+                with self.subTest(backend=backend):
+                    record = scanner.process_pdf(pdf_path, backend=backend, use_mmap=True)
+                    self.assertEqual(record, scanner.process_pdf(pdf_path, backend=backend))
+                    self.assertEqual(record.images[0].metadata["271"], "Cam")
+                    with self.assertLogs(level="WARNING"):
+                        record = scanner.process_pdf(empty, backend=backend, use_mmap=True)
+                    self.assertEqual(record, scanner.DocumentRecord(empty))
+
+    def test_pypdf_backend_leaves_pikepdf_unloaded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf_with_attachments(
+                os.path.join(tmp, "doc.pdf"), {"photo.jpg": jpeg_with_make("Phone")}
+            )
+            code = (
+                "import sys, scanner; "
+                f"scanner.process_pdf({pdf_path!r}, backend='pypdf', attachment_depth=1, "
+                "max_decoded_bytes=1 << 20); "
+                "print(any(name.startswith('pikepdf.') for name in sys.modules))"
+            )
+            root = os.path.dirname(os.path.abspath(scanner.__file__))
+            result = subprocess.run(
+                [sys.executable, "-c", code],
+                env=dict(os.environ, PYTHONPATH=root),
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            self.assertEqual(result.stdout.strip(), "False")
+
+    def test_docinfo_order_does_not_depend_on_the_hash_seed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            docinfo = {f"/Key{i}": f"value {i}" for i in range(20)}
+            pdf_path = make_pdf(os.path.join(tmp, "doc.pdf"), docinfo=docinfo)
+            root = os.path.dirname(os.path.abspath(scanner.__file__))
+            for backend in scanner.BACKENDS:
+                with self.subTest(backend=backend):
+                    code = (
+                        "import json, scanner; "
+                        f"record = scanner.process_pdf({pdf_path!r}, backend={backend!r}); "
+                        "print(json.dumps(list(record.docinfo)))"
+                    )
+                    orders = {
+                        subprocess.run(
+                            [sys.executable, "-c", code],
+                            env=dict(os.environ, PYTHONPATH=root, PYTHONHASHSEED=str(seed)),
+                            check=True,
+                            capture_output=True,
+                            text=True,
+                        ).stdout
+                        for seed in range(4)
+                    }
+                    self.assertEqual(len(orders), 1)
+                    self.assertEqual(json.loads(orders.pop()), sorted(docinfo))
+
+    def test_pikepdf_backend_logs_unreadable_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "broken.pdf")
+            with open(pdf_path, "w") as f:
+                f.write("not a pdf")
+            out = StringIO()
+            with self.assertLogs(level="WARNING") as cm:
+                scanner.process_pdf(pdf_path, out)
+            self.assertEqual(out.getvalue(), "")
+            self.assertIn("Could not extract PDF metadata", "\n".join(cm.output))
+
+
+class TestSharedImages(unittest.TestCase):
+    def test_shared_image_is_read_once_and_reported_with_pages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf(os.path.join(tmp, "doc.pdf"), exif_make="Cam", pages=3)
+            for backend in scanner.BACKENDS:
+                with (
+                    self.subTest(backend=backend),
+                    patch("scanner.read_image_metadata", wraps=scanner.read_image_metadata) as read,
+                ):
+                    out = StringIO()
+                    scanner.process_pdf(pdf_path, out, backend=backend)
+                    output = out.getvalue()
+                    read.assert_called_once()
+                    self.assertEqual(output.count("[Image Metadata]"), 1)
+                    self.assertIn(f"[Image Metadata] {pdf_path} - Pages 1-3 - /Im0", output)
+
+    def test_format_pages(self):
+        self.assertEqual(scanner.format_pages([1]), "1")
+        self.assertEqual(scanner.format_pages([1, 2, 3, 7, 9, 10]), "1-3, 7, 9-10")
+
+
+def make_pdf_with_forms(path):
+    """Pages 1-2 show a shared form (nested form -> image, plus a cycle back to itself),
+    page 3 has an annotation appearance with an image and an inline JPEG."""
+    pdf = pikepdf.new()
+    for _ in range(3):
+        pdf.add_blank_page()
+
+    def image(make):
+        return pikepdf.Stream(
+            pdf,
+            jpeg_with_make(make),
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Image,
+            Width=8,
+            Height=8,
+            ColorSpace=pikepdf.Name.DeviceRGB,
+            BitsPerComponent=8,
+            Filter=pikepdf.Name.DCTDecode,
+        )
+
+    def form(content, xobjects):
+        return pdf.make_indirect(
+            pikepdf.Stream(
+                pdf,
+                content,
+                Type=pikepdf.Name.XObject,
+                Subtype=pikepdf.Name.Form,
+                BBox=[0, 0, 8, 8],
+                Resources=pikepdf.Dictionary(XObject=pikepdf.Dictionary(xobjects)),
+            )
+        )
+
+    inner = form(b"/Im0 Do", {"/Im0": image("Nested")})
+    outer = form(b"/Fm1 Do", {"/Fm1": inner})
+    outer.Resources.XObject.Fm0 = outer
+    for page in pdf.pages[:2]:
+        page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Fm0=outer))
+
+    stamp = form(b"/Im0 Do", {"/Im0": image("Stamp")})
+    page = pdf.pages[2]
+    page.Annots = pdf.make_indirect(
+        [
+            pikepdf.Dictionary(
+                Type=pikepdf.Name.Annot,
+                Subtype=pikepdf.Name.Stamp,
+                Rect=[0, 0, 8, 8],
+                AP=pikepdf.Dictionary(N=stamp),
+            )
+        ]
+    )
+    inline = b"q BI /W 8 /H 8 /CS /RGB /BPC 8 /F /DCT ID " + jpeg_with_make("Inline") + b"\nEI Q"
+    page.Contents = pdf.make_stream(inline)
+    pdf.save(path)
+    return path
+
+
+class TestNestedResources(unittest.TestCase):
+    def test_forms_annotations_and_inline_images(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf_with_forms(os.path.join(tmp, "forms.pdf"))
+            for backend in scanner.BACKENDS:
+                with (
+                    self.subTest(backend=backend),
+                    patch("scanner.read_image_metadata", wraps=scanner.read_image_metadata) as read,
+                ):
+                    record = scanner.process_pdf(pdf_path, backend=backend, inline_images=True)
+                    images = {
+                        image.name: (image.pages, image.metadata["271"]) for image in record.images
+                    }
+                    self.assertEqual(
+                        images,
+                        {
+                            "/Fm0/Fm1/Im0": ([1, 2], "Nested"),
+                            "/Annot0/N/Im0": ([3], "Stamp"),
+                            "/BI0": ([3], "Inline"),
+                        },
+                    )
+                    self.assertEqual(read.call_count, 2)
+
+                    record = scanner.process_pdf(pdf_path, backend=backend)
+                    self.assertNotIn("/BI0", [image.name for image in record.images])
+
+    def test_inline_jpegs(self):
+        jpeg = jpeg_with_make("Cam")
+        content = b"BI /W 8 /H 8 /F [/DCT] ID " + jpeg + b"\nEI BI /F /Fl ID xx EI"
+        headers = list(scanner.inline_jpegs(content))
+        self.assertEqual(len(headers), 1)
+        self.assertEqual(bytes(headers[0]), scanner.jpeg_header(jpeg))
+        self.assertEqual(list(scanner.inline_jpegs(b"0 0 m 1 1 l S")), [])
+
+
+XMP_PACKET = b"""<?xpacket begin="\xef\xbb\xbf" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" pdf:Producer="Writer"
+    xmlns:pdf="http://ns.adobe.com/pdf/1.3/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/"
+    xmlns:stEvt="http://ns.adobe.com/xap/1.0/sType/ResourceEvent#">
+   <dc:title><rdf:Alt>
+    <rdf:li xml:lang="de">Bericht</rdf:li>
+    <rdf:li xml:lang="x-default">Report</rdf:li>
+   </rdf:Alt></dc:title>
+   <dc:creator><rdf:Seq><rdf:li>Jane</rdf:li><rdf:li>John</rdf:li></rdf:Seq></dc:creator>
+   <dc:rights rdf:resource="https://example.com/licence"/>
+   <xmpMM:History><rdf:Seq>
+    <rdf:li stEvt:action="created" stEvt:when="2024-01-01"/>
+    <rdf:li rdf:parseType="Resource"><stEvt:action>saved</stEvt:action></rdf:li>
+   </rdf:Seq></xmpMM:History>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>"""
+
+
+class TestXmp(unittest.TestCase):
+    def test_parse_xmp_flattens_properties(self):
+        self.assertEqual(
+            scanner.parse_xmp(XMP_PACKET, "doc.pdf"),
+            {
+                "pdf:Producer": "Writer",
+                "dc:title[de]": "Bericht",
+                "dc:title": "Report",
+                "dc:creator[1]": "Jane",
+                "dc:creator[2]": "John",
+                "dc:rights": "https://example.com/licence",
+                "xmpMM:History[1]/stEvt:action": "created",
+                "xmpMM:History[1]/stEvt:when": "2024-01-01",
+                "xmpMM:History[2]/stEvt:action": "saved",
+            },
+        )
+
+    def test_parse_xmp_is_fed_in_chunks(self):
+        thumbnail = "A" * (3 * scanner.XMP_FEED_SIZE)
+        packet = XMP_PACKET.replace(
+            b"<dc:title>", f"<dc:format>{thumbnail}</dc:format><dc:title>".encode()
+        )
+        properties = scanner.parse_xmp(packet, "doc.pdf")
+        self.assertEqual(properties["dc:format"], thumbnail)
+        self.assertEqual(properties["dc:title"], "Report")
+
+    def test_parse_xmp_invalid_xml_logs_warning(self):
+        with self.assertLogs(level="WARNING") as cm:
+            self.assertEqual(scanner.parse_xmp(b"<bad><xml>", "doc.pdf"), {})
+        self.assertIn("Failed to parse XMP/RDF", "\n".join(cm.output))
+
+    def test_unknown_encoding_keeps_the_rest_of_the_file(self):
+        packet = b'<?xml version="1.0" encoding="bogus"?>' + XMP_PACKET
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf(os.path.join(tmp, "doc.pdf"), docinfo={"/Title": "Kept"})
+            with pikepdf.open(pdf_path, allow_overwriting_input=True) as pdf:
+                pdf.Root.Metadata = pdf.make_stream(packet)
+                pdf.save(pdf_path, fix_metadata_version=False)
+            for backend in scanner.BACKENDS:
+                with self.subTest(backend=backend):
+                    with self.assertLogs(level="WARNING") as cm:
+                        record = scanner.process_pdf(pdf_path, backend=backend)
+                    self.assertIn("Failed to parse XMP/RDF", "\n".join(cm.output))
+                    self.assertEqual(record.docinfo, {"/Title": "Kept"})
+                    self.assertEqual(record.xmp, {})
+
+    def test_raw_packet_is_opt_in(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "doc.pdf")
+            with pikepdf.new() as pdf:
+                pdf.add_blank_page()
+                pdf.Root.Metadata = pdf.make_stream(XMP_PACKET)
+                pdf.save(pdf_path, fix_metadata_version=False)
+            for backend in scanner.BACKENDS:
+                with self.subTest(backend=backend):
+                    out = StringIO()
+                    record = scanner.process_pdf(pdf_path, out, backend=backend)
+                    self.assertIsNone(record.xmp_packet)
+                    self.assertIn(
+                        f"[XMP Metadata] {pdf_path}\n    pdf:Producer: Writer", out.getvalue()
+                    )
+                    self.assertNotIn("[XMP Packet]", out.getvalue())
+
+                    out = StringIO()
+                    record = scanner.process_pdf(pdf_path, out, backend=backend, xmp_packet=True)
+                    self.assertEqual(record.xmp_packet.encode(), XMP_PACKET)
+                    self.assertIn(f"[XMP Packet] {pdf_path}\n<?xpacket", out.getvalue())
+
+
+def jp2_box(box_type, payload):
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+class TestImageHeaders(unittest.TestCase):
+    def test_jpeg_header_stops_at_start_of_scan(self):
+        img = Image.new("RGB", (64, 64), color="red")
+        exif = img.getexif()
+        exif[0x010F] = "Cam"
+        bio = BytesIO()
+        img.save(bio, format="JPEG", exif=exif)
+        data = bio.getvalue()
+
+        header = scanner.jpeg_header(data)
+        self.assertLess(len(header), len(data))
+        self.assertEqual(header[-1:], data[len(header) - 1 : len(header)])
+        self.assertEqual(Image.open(BytesIO(header)).getexif()[0x010F], "Cam")
+
+    def test_jpeg_header_returns_unparseable_data(self):
+        self.assertEqual(scanner.jpeg_header(b"fakejpegdata"), b"fakejpegdata")
+
+    def test_read_jp2_metadata(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Cam"
+        data = (
+            jp2_box(b"jP  ", b"\r\n\x87\n")
+            + jp2_box(b"jp2c", b"\xff\x4f" + b"\x00" * 64)
+            + jp2_box(b"uuid", scanner.JP2_XMP_UUID + b"<x:xmpmeta/>")
+            + jp2_box(b"uuid", scanner.JP2_EXIF_UUID + exif.tobytes())
+        )
+        metadata = scanner.read_jp2_metadata(data)
+        self.assertEqual(metadata["xmp"], b"<x:xmpmeta/>")
+        self.assertEqual(metadata[0x010F], "Cam")
+
+    def test_flate_image_stream_is_not_read(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "doc.pdf")
+            pdf = pikepdf.new()
+            pdf.add_blank_page()
+            image = pikepdf.Stream(pdf, b"\x00" * 192, Subtype=pikepdf.Name.Image)
+            image.write(b"\x00" * 192, filter=pikepdf.Name.FlateDecode)
+            pdf.pages[0].Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image))
+            pdf.save(pdf_path)
+
+            with (
+                patch("scanner._read_image_data") as read,
+                self.assertNoLogs(level="WARNING"),
+            ):
+                scanner.process_pdf(pdf_path, StringIO())
+            read.assert_not_called()
+
+
+def make_pdf_with_xmp(path, size):
+    """Write a PDF whose Flate-compressed XMP packet inflates to roughly ``size`` bytes."""
+    # qpdf always stores /Metadata uncompressed, so this one is written with pypdf.
+    writer = PdfWriter()
+    writer.add_blank_page(72, 72)
+    packet = b"<x:xmpmeta xmlns:x='adobe:ns:meta/'>" + b" " * size + b"</x:xmpmeta>"
+    metadata = DecodedStreamObject()
+    metadata.set_data(packet)
+    metadata = metadata.flate_encode()
+    metadata[NameObject("/Type")] = NameObject("/Metadata")
+    metadata[NameObject("/Subtype")] = NameObject("/XML")
+    writer._root_object[NameObject("/Metadata")] = writer._add_object(metadata)
+    writer.write(path)
+    return path
+
+
+def slow_collect_images(pages, pdf_path, limits=None, inline_images=False, first_hit=False):
+    while True:
+        time.sleep(0.01)
+
+
+class TestFileLimits(TempDirTestCase):
+    def assertSkipped(self, record, reason):
+        self.assertIn(reason, record.skipped)
+        self.assertEqual(record.docinfo, {})
+        self.assertEqual(record.images, [])
+
+    def test_max_pages(self):
+        pdf_path = make_pdf(os.path.join(self.tmp.name, "long.pdf"), docinfo={"/T": "x"}, pages=3)
+        for backend in scanner.BACKENDS:
+            with self.subTest(backend=backend):
+                out = StringIO()
+                with self.assertLogs(level="WARNING") as cm:
+                    record = scanner.process_pdf(pdf_path, out, backend=backend, max_pages=2)
+                self.assertSkipped(record, "3 pages exceeds the limit of 2")
+                self.assertIn(f"[Skipped] {pdf_path}", out.getvalue())
+                self.assertIn("Skipped", "\n".join(cm.output))
+                self.assertIsNone(scanner.process_pdf(pdf_path, backend=backend).skipped)
+
+    def test_max_decoded_bytes_stops_inflating_xmp(self):
+        pdf_path = make_pdf_with_xmp(os.path.join(self.tmp.name, "bomb.pdf"), 100_000)
+        for backend in scanner.BACKENDS:
+            with self.subTest(backend=backend):
+                with self.assertLogs(level="WARNING"):
+                    record = scanner.process_pdf(
+                        pdf_path, backend=backend, max_decoded_bytes=10_000
+                    )
+                self.assertSkipped(record, "decoded more than 10000 bytes")
+                record = scanner.process_pdf(
+                    pdf_path, backend=backend, max_decoded_bytes=200_000, xmp_packet=True
+                )
+                self.assertIsNone(record.skipped)
+                self.assertIn("xmpmeta", record.xmp_packet)
+
+    def test_pypdf_inflates_within_the_budget(self):
+        pdf_path = make_pdf_with_xmp(os.path.join(self.tmp.name, "bomb.pdf"), 100_000)
+        with (
+            patch.object(EncodedStreamObject, "get_data") as get_data,
+            self.assertLogs(level="WARNING"),
+        ):
+            record = scanner.process_pdf(pdf_path, backend="pypdf", max_decoded_bytes=10_000)
+        get_data.assert_not_called()
+        self.assertSkipped(record, "decoded more than 10000 bytes")
+
+    def test_max_decoded_bytes_counts_images(self):
+        pdf_path = make_pdf(os.path.join(self.tmp.name, "img.pdf"), exif_make="Cam")
+        with self.assertLogs(level="WARNING"):
+            record = scanner.process_pdf(pdf_path, max_decoded_bytes=10)
+        self.assertSkipped(record, "decoded more than 10 bytes")
+
+    def test_file_timeout(self):
+        pdf_path = make_pdf(os.path.join(self.tmp.name, "slow.pdf"), docinfo={"/T": "x"})
+        with (
+            patch("scanner.collect_images", slow_collect_images),
+            self.assertLogs(level="WARNING"),
+        ):
+            record = scanner.process_pdf(pdf_path, file_timeout=0.05)
+        self.assertSkipped(record, "timed out after 0.05s")
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+    def test_timeout_during_the_first_import(self):
+        # A fresh interpreter whose first pikepdf import outlasts --file-timeout.
+        pdf_path = make_pdf(os.path.join(self.tmp.name, "doc.pdf"), docinfo={"/T": "x"})
+        code = f"""
+import importlib.util, sys, time
+
+spec = importlib.util.find_spec("pikepdf")
+loader = spec.loader
+
+
+class ColdLoader(type(loader)):
+    def exec_module(self, module):
+        time.sleep(0.5)
+        super().exec_module(module)
+
+
+spec.loader = importlib.util.LazyLoader(ColdLoader(loader.name, loader.path))
+module = importlib.util.module_from_spec(spec)
+sys.modules["pikepdf"] = module
+spec.loader.exec_module(module)
+
+import scanner
+
+for _ in range(2):
+    print(scanner.process_pdf({pdf_path!r}, file_timeout=0.2).docinfo)
+"""
+        root = os.path.dirname(os.path.abspath(scanner.__file__))
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            env=dict(os.environ, PYTHONPATH=root),
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.stdout.splitlines(), ["{'/T': 'x'}"] * 2)
+
+    def test_skipped_files_are_not_cached(self):
+        folder = os.path.join(self.tmp.name, "docs")
+        os.mkdir(folder)
+        make_pdf(os.path.join(folder, "long.pdf"), pages=3)
+        cache_path = os.path.join(self.tmp.name, "cache.sqlite")
+        for _ in range(2):
+            with (
+                scanner.ResultCache(cache_path) as cache,
+                self.assertLogs(level="WARNING"),
+            ):
+                scanner.scan_folder(folder, StringIO(), cache=cache, max_pages=1)
+            self.assertEqual(cache.hits, 0)
+
+
+class TestDiscovery(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        for rel in ["a.pdf", "b.PDF", "skip.txt", "sub/c.pdf", "sub/deeper/d.pdf", "z/e.pdf"]:
+            path = os.path.join(self.tmp.name, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("dummy")
+
+    def test_iter_pdf_files_matches_os_walk(self):
+        walked = [
+            os.path.join(root, f)
+            for root, _, files in os.walk(self.tmp.name)
+            for f in files
+            if f.lower().endswith(".pdf")
+        ]
+        self.assertEqual(list(scanner.iter_pdf_files(self.tmp.name)), walked)
+
+    def test_iter_pdf_files_is_lazy(self):
+        found = scanner.iter_pdf_files(self.tmp.name)
+        with patch("scanner.os.scandir", wraps=os.scandir) as scandir:
+            next(found)
+            self.assertEqual(scandir.call_count, 1)
+
+    def test_iter_pdf_files_missing_folder_logs_warning(self):
+        with self.assertLogs(level="WARNING") as cm:
+            found = list(scanner.iter_pdf_files(os.path.join(self.tmp.name, "missing")))
+        self.assertEqual(found, [])
+        self.assertIn("Could not list", "\n".join(cm.output))
+
+    def test_progress_total_only_with_prefetch(self):
+        for prefetch, total in [(False, None), (True, 5)]:
+            with (
+                self.subTest(prefetch_count=prefetch),
+                patch("scanner.process_pdf"),
+                patch("scanner.tqdm.tqdm", side_effect=lambda it, **kw: it) as bar,
+            ):
+                scanner.scan_folder(
+                    self.tmp.name, StringIO(), show_progress=True, prefetch_count=prefetch
+                )
+                self.assertEqual(bar.call_args.kwargs["total"], total)
+
+
+class TestParallelScan(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_docs(6, self.tmp.name)
+
+    def test_parallel_output_matches_serial(self):
+        serial = StringIO()
+        scanner.scan_folder(self.tmp.name, serial)
+        parallel = StringIO()
+        scanner.scan_folder(self.tmp.name, parallel, jobs=3)
+        self.assertEqual(parallel.getvalue(), serial.getvalue())
+
+    def test_unordered_yields_every_file(self):
+        results = list(scanner.scan_parallel(self.paths, 2, {}, ordered=False))
+        self.assertEqual(sorted(r.path for r in results), sorted(self.paths))
+
+    def test_worker_crash_is_isolated(self):
+        bad = os.path.join(self.tmp.name, "bad.pdf")
+        paths = self.paths[:3] + [bad] + self.paths[3:]
+        with patch("scanner.scan_file", crash_on_bad_pdf):
+            results = list(scanner.scan_parallel(paths, 2, {}))
+        self.assertEqual([r.path for r in results], paths)
+        self.assertEqual(results[3].error, "worker crashed")
+        self.assertTrue(all(r.error is None for r in results if r.path != bad))
+        self.assertIsNone(results[3].record)
+        self.assertEqual(results[-1].record.docinfo, {"/Title": "T5"})
+
+    def test_scan_file_captures_logs(self):
+        broken = os.path.join(self.tmp.name, "broken.pdf")
+        with open(broken, "w") as f:
+            f.write("not a pdf")
+        with self.assertNoLogs(level="WARNING"):
+            result = scanner.scan_file(broken, {})
+        self.assertEqual(result.record, scanner.DocumentRecord(broken))
+        self.assertTrue(any("Could not extract" in msg for _, msg in result.logs))
+
+
+class TestShards(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = os.path.join(self.tmp.name, "docs")
+        os.makedirs(os.path.join(self.folder, "sub"))
+        self.paths = [
+            make_pdf(os.path.join(self.folder, name), docinfo={"/Title": name})
+            for name in ("a.pdf", "b.pdf", "c.pdf", "sub/d.pdf", "sub/e.pdf")
+        ]
+        self.paths.append(make_pdf(os.path.join(self.folder, "f.pdf"), exif_make="Cam"))
+
+    def scan(self, name, output_format="jsonl", **kwargs):
+        out_path = os.path.join(self.tmp.name, f"{name}.{output_format}")
+        with scanner.open_output(out_path, output_format) as out:
+            scanner.scan_folder(self.folder, out, **kwargs)
+        return out_path
+
+    def test_parse_shard(self):
+        self.assertEqual(scanner.parse_shard("2/3"), (2, 3))
+        for spec in ("0/3", "4/3", "1", "a/b", "1/2/3"):
+            with self.subTest(spec=spec), self.assertRaises(argparse.ArgumentTypeError):
+                scanner.parse_shard(spec)
+
+    def test_shards_partition_the_folder(self):
+        shards = [list(scanner.iter_selected_files(self.folder, (k, 3))) for k in (1, 2, 3)]
+        found = [path for shard in shards for path in shard]
+        self.assertEqual(sorted(found), sorted(self.paths))
+        self.assertEqual(len(found), len(set(found)))
+        # The partition depends on the relative path only, not on where the folder lives.
+        moved = os.path.join(self.tmp.name, "moved")
+        shutil.copytree(self.folder, moved)
+        relative = [os.path.relpath(p, self.folder) for p in shards[0]]
+        moved_shard = scanner.iter_selected_files(moved, (1, 3))
+        self.assertEqual(sorted(os.path.relpath(p, moved) for p in moved_shard), sorted(relative))
+
+    def test_merged_shards_match_single_run(self):
+        single = self.scan("single")
+        expected = scanner.JsonlWriter(StringIO())
+        self.assertEqual(scanner.merge_outputs([single], expected), len(self.paths))
+        expected.flush()
+
+        output_formats = ["jsonl", "csv"]
+        if importlib.util.find_spec("pyarrow"):
+            output_formats.append("parquet")
+        for output_format in output_formats:
+            with self.subTest(output_format=output_format):
+                shards = [
+                    self.scan(f"shard{k}", output_format, shard=(k, 3), jobs=2) for k in (1, 2, 3)
+                ]
+                merged = scanner.JsonlWriter(StringIO())
+                scanner.merge_outputs(shards, merged)
+                merged.flush()
+                self.assertEqual(merged.stream.getvalue(), expected.stream.getvalue())
+
+        paths = [json.loads(line)["path"] for line in expected.stream.getvalue().splitlines()]
+        self.assertEqual(paths, sorted(self.paths))
+
+    def test_external_merge_and_duplicates(self):
+        shards = [self.scan(f"shard{k}", shard=(k, 2)) for k in (1, 2)]
+        records = list(scanner.sorted_records(shards + shards[:1], run_size=2))
+        self.assertEqual(len(records), len(self.paths) + len(list(scanner.read_records(shards[0]))))
+        self.assertEqual([r["path"] for r in records], sorted(r["path"] for r in records))
+        with self.assertLogs(level="WARNING"):
+            written = scanner.merge_outputs(shards + shards[:1], scanner.JsonlWriter(StringIO()))
+        self.assertEqual(written, len(self.paths))
+
+    def test_merge_large_csv_fields(self):
+        record = scanner.DocumentRecord(self.paths[0], xmp_packet="x" * (200 * 1024))
+        csv_path = os.path.join(self.tmp.name, "large.csv")
+        with scanner.open_output(csv_path, "csv") as out:
+            out.write(record)
+        self.assertEqual(list(scanner.read_records(csv_path)), [record.as_dict()])
+
+    def test_merge_stats(self):
+        snapshots = []
+        for k in (1, 2):
+            stats = scanner.ScanStats(top_n=2)
+            scanner.scan_folder(self.folder, StringIO(), stats=stats, shard=(k, 2))
+            snapshots.append(json.loads(json.dumps(stats.snapshot())))
+        merged = scanner.ScanStats.from_snapshots(snapshots, top_n=3).snapshot()
+        self.assertEqual(merged["files"], len(self.paths))
+        self.assertEqual(merged["counters"]["pages"], len(self.paths))
+        self.assertEqual(merged["elapsed"], max(s["elapsed"] for s in snapshots))
+        self.assertEqual(len(merged["slowest"]), 3)
+        self.assertGreaterEqual(merged["slowest"][0][0], merged["slowest"][-1][0])
+
+    def test_merge_command(self):
+        shards = [self.scan(f"shard{k}", shard=(k, 2)) for k in (1, 2)]
+        out_path = os.path.join(self.tmp.name, "merged.csv")
+        argv = ["pdfscan", "merge", *shards, "-o", out_path, "-f", "csv"]
+        with patch.object(sys, "argv", argv), redirect_stderr(StringIO()) as err:
+            scanner.main()
+        self.assertIn(f"Merged {len(self.paths)} records", err.getvalue())
+        with open(out_path, newline="") as f:
+            self.assertEqual([row["path"] for row in csv.DictReader(f)], sorted(self.paths))
+
+
+def make_pdf_with_page_images(path, makes):
+    """Write a PDF with one page per EXIF Make in ``makes``, each with its own JPEG."""
+    pdf = pikepdf.new()
+    for make in makes:
+        pdf.add_blank_page()
+        image = pikepdf.Stream(
+            pdf,
+            jpeg_with_make(make),
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Image,
+            Width=8,
+            Height=8,
+            ColorSpace=pikepdf.Name.DeviceRGB,
+            BitsPerComponent=8,
+            Filter=pikepdf.Name.DCTDecode,
+        )
+        pdf.pages[-1].Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image))
+    pdf.save(path)
+    return path
+
+
+class TestSelection(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = self.tmp.name
+
+    def test_parse_stages(self):
+        self.assertEqual(scanner.parse_stages("images, docinfo"), ("docinfo", "images"))
+        for spec in ("", "pages", "docinfo,pages"):
+            with self.subTest(spec=spec), self.assertRaises(argparse.ArgumentTypeError):
+                scanner.parse_stages(spec)
+
+    def test_only_runs_selected_stages(self):
+        pdf_path = make_pdf(
+            os.path.join(self.folder, "doc.pdf"), docinfo={"/Title": "T"}, exif_make="Cam"
+        )
+        for backend in scanner.BACKENDS:
+            with self.subTest(backend=backend):
+                stats = scanner.ScanStats()
+                with scanner.track_file(pdf_path) as file_stats:
+                    record = scanner.process_pdf(pdf_path, backend=backend, only=("docinfo",))
+                stats.add(file_stats.as_dict())
+                self.assertEqual(record.docinfo, {"/Title": "T"})
+                self.assertEqual(record.images, [])
+                self.assertNotIn("images", stats.stages)
+
+                record = scanner.process_pdf(pdf_path, backend=backend, only=("images",))
+                self.assertEqual(record.docinfo, {})
+                self.assertEqual(record.images[0].metadata["271"], "Cam")
+
+    def test_first_hit_stops_early(self):
+        with_docinfo = make_pdf(
+            os.path.join(self.folder, "info.pdf"), docinfo={"/Title": "T"}, exif_make="Cam"
+        )
+        images_only = make_pdf_with_page_images(
+            os.path.join(self.folder, "images.pdf"), ["A", "B", "C"]
+        )
+        for backend in scanner.BACKENDS:
+            with self.subTest(backend=backend):
+                record = scanner.process_pdf(with_docinfo, backend=backend, first_hit=True)
+                self.assertEqual((record.docinfo, record.images), ({"/Title": "T"}, []))
+
+                full = scanner.process_pdf(images_only, backend=backend)
+                self.assertEqual(len(full.images), 3)
+                with scanner.track_file(images_only) as file_stats:
+                    record = scanner.process_pdf(images_only, backend=backend, first_hit=True)
+                self.assertEqual(record.images, full.images[:1])
+                self.assertEqual(file_stats.counters["pages"], 1)
+
+                empty = make_pdf(os.path.join(self.folder, "empty.pdf"), pages=2)
+                self.assertFalse(scanner.process_pdf(empty).has_metadata())
+
+    def test_min_pages_drops_small_files(self):
+        small = make_pdf(os.path.join(self.folder, "small.pdf"), docinfo={"/Title": "S"})
+        big = make_pdf(os.path.join(self.folder, "big.pdf"), docinfo={"/Title": "B"}, pages=3)
+        for backend in scanner.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertIsNone(scanner.process_pdf(small, backend=backend, min_pages=2))
+                self.assertIsNotNone(scanner.process_pdf(big, backend=backend, min_pages=2))
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                out = StringIO()
+                stats = scanner.ScanStats()
+                scanner.scan_folder(self.folder, out, jobs=jobs, stats=stats, min_pages=2)
+                self.assertIn(big, out.getvalue())
+                self.assertNotIn(small, out.getvalue())
+                self.assertEqual(stats.counters["filtered"], 1)
+
+    def test_path_filter(self):
+        os.mkdir(os.path.join(self.folder, "2024"))
+        small = make_pdf(os.path.join(self.folder, "2024", "small.pdf"))
+        big = make_pdf(os.path.join(self.folder, "2024", "big.pdf"), pages=50)
+        other = make_pdf(os.path.join(self.folder, "other.pdf"))
+        size = os.path.getsize(small)
+
+        def selected(**kwargs):
+            path_filter = scanner.PathFilter(**kwargs)
+            return sorted(scanner.iter_selected_files(self.folder, path_filter=path_filter))
+
+        self.assertEqual(selected(globs=["2024/*"]), sorted([small, big]))
+        self.assertEqual(selected(globs=["*/s*.pdf", "o*"]), sorted([small, other]))
+        self.assertEqual(selected(max_size=size), sorted([small, other]))
+        self.assertEqual(selected(min_size=size + 1), [big])
+        self.assertEqual(selected(globs=["2024/*"], max_size=size), [small])
+
+
+def make_pdf_with_attachments(path, files, annotation=None):
+    """Write a PDF embedding ``files`` (name -> bytes), plus one file-attachment annotation."""
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    for name, data in files.items():
+        pdf.attachments[name] = pikepdf.AttachedFileSpec(pdf, data)
+    if annotation:
+        name, data = annotation
+        spec = pikepdf.AttachedFileSpec(pdf, data, filename=name)
+        annot = pikepdf.Dictionary(
+            Type=pikepdf.Name.Annot,
+            Subtype=pikepdf.Name.FileAttachment,
+            Rect=[0, 0, 10, 10],
+            FS=spec.obj,
+        )
+        pdf.pages[0].Annots = pdf.make_indirect(pikepdf.Array([pdf.make_indirect(annot)]))
+    pdf.save(path)
+    return path
+
+
+class TestAttachments(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        inner = make_pdf(
+            os.path.join(self.tmp.name, "inner.pdf"), docinfo={"/Title": "Inner"}, exif_make="Cam"
+        )
+        with open(inner, "rb") as f:
+            inner_data = f.read()
+        middle = make_pdf_with_attachments(
+            os.path.join(self.tmp.name, "middle.pdf"), {"inner.pdf": inner_data}
+        )
+        with open(middle, "rb") as f:
+            middle_data = f.read()
+        self.pdf_path = make_pdf_with_attachments(
+            os.path.join(self.tmp.name, "outer.pdf"),
+            {"middle.pdf": middle_data, "photo.jpg": jpeg_with_make("Phone")},
+            annotation=("note.txt", b"hello"),
+        )
+
+    def test_attachments_are_off_by_default(self):
+        self.assertEqual(scanner.process_pdf(self.pdf_path).attachments, [])
+
+    def test_nested_attachments(self):
+        for backend in scanner.BACKENDS:
+            with self.subTest(backend=backend):
+                record = scanner.process_pdf(self.pdf_path, backend=backend, attachment_depth=2)
+                by_name = {a.name: a for a in record.attachments}
+                self.assertEqual(set(by_name), {"middle.pdf", "photo.jpg", "note.txt"})
+                self.assertEqual(by_name["photo.jpg"].metadata["271"], "Phone")
+                self.assertEqual(by_name["note.txt"].source, "Page 1")
+                self.assertEqual(by_name["note.txt"].size, 5)
+                self.assertEqual(by_name["note.txt"].metadata, {})
+
+                middle = by_name["middle.pdf"].document
+                self.assertEqual(middle.path, f"{self.pdf_path}::middle.pdf")
+                inner = middle.attachments[0].document
+                self.assertEqual(inner.path, f"{self.pdf_path}::middle.pdf::inner.pdf")
+                self.assertEqual(inner.docinfo, {"/Title": "Inner"})
+                self.assertEqual(inner.images[0].metadata["271"], "Cam")
+
+                record = scanner.process_pdf(self.pdf_path, backend=backend, attachment_depth=1)
+                middle = record.attachments[0].document
+                self.assertEqual(middle.attachments, [])
+
+    def test_size_limit_and_first_hit(self):
+        record = scanner.process_pdf(self.pdf_path, attachment_depth=2, max_attachment_bytes=100)
+        skipped = {a.name: a.skipped for a in record.attachments}
+        self.assertEqual(skipped["note.txt"], None)
+        self.assertEqual(skipped["middle.pdf"], "larger than 100 bytes")
+        self.assertIsNone(record.attachments[0].document)
+
+        record = scanner.process_pdf(self.pdf_path, attachment_depth=2, first_hit=True)
+        self.assertEqual(len(record.attachments), 1)
+
+    def test_size_limit_without_declared_size(self):
+        pdf_path = os.path.join(self.tmp.name, "bomb.pdf")
+        make_pdf_with_attachments(pdf_path, {"zeros.bin": bytes(1_000_000)})
+        with pikepdf.open(pdf_path, allow_overwriting_input=True) as pdf:
+            pdf.docinfo["/Title"] = "Parent"
+            del pdf.attachments["zeros.bin"].obj.EF.F.Params
+            pdf.save(pdf_path)
+        for backend in scanner.BACKENDS:
+            with self.subTest(backend=backend):
+                record = scanner.process_pdf(
+                    pdf_path, backend=backend, attachment_depth=1, max_attachment_bytes=1000
+                )
+                self.assertIsNone(record.skipped)
+                self.assertEqual(record.docinfo, {"/Title": "Parent"})
+                self.assertEqual(record.attachments[0].skipped, "larger than 1000 bytes")
+
+    def test_text_and_structured_output(self):
+        out = StringIO()
+        scanner.process_pdf(self.pdf_path, out, attachment_depth=2)
+        text = out.getvalue()
+        self.assertIn(f"[Attachment] {self.pdf_path} - Page 1 - note.txt (5 bytes)", text)
+        self.assertIn(f"[PDF Metadata] {self.pdf_path}::middle.pdf::inner.pdf", text)
+
+        record = scanner.process_pdf(self.pdf_path, attachment_depth=2)
+        for output_format in ("jsonl", "csv"):
+            with self.subTest(output_format=output_format):
+                out_path = os.path.join(self.tmp.name, f"out.{output_format}")
+                with scanner.open_output(out_path, output_format) as out:
+                    scanner.write_record(record, out)
+                self.assertEqual(list(scanner.read_records(out_path)), [record.as_dict()])
+
+
+class TestDedup(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = self.tmp.name
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_groups_by_size_partial_and_full_hash(self):
+        block = scanner.Deduplicator.BLOCK_SIZE
+        big = b"h" * block + b"middle" + b"t" * block
+        paths = [
+            self.write("big1", big),
+            self.write("x/big2", big),
+            # Same size, head and tail as big1: only the full hash tells them apart.
+            self.write("big3", big.replace(b"middle", b"MIDDLE")),
+            self.write("small1", b"small"),
+            self.write("y/small2", b"small"),
+            self.write("other", b"smell"),
+            self.write("alone", b"a different size"),
+        ]
+        dedup = scanner.Deduplicator()
+        unique = dedup.unique(paths)
+        self.assertEqual(unique, [paths[0], paths[2], paths[3], paths[5], paths[6]])
+        self.assertEqual(dedup.duplicates, {paths[0]: [paths[1]], paths[3]: [paths[4]]})
+        self.assertEqual((dedup.files, dedup.bytes), (2, len(big) + 5))
+        self.assertIn("Skipped 2 duplicate files", dedup.summary())
+
+    def test_scan_lists_all_paths_once(self):
+        original = make_pdf(os.path.join(self.folder, "a.pdf"), docinfo={"/Title": "Same"})
+        with open(original, "rb") as f:
+            data = f.read()
+        copies = [self.write(f"copy{i}/a.pdf", data) for i in range(2)]
+        other = make_pdf(os.path.join(self.folder, "b.pdf"), docinfo={"/Title": "Other"})
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                out = scanner.JsonlWriter(StringIO())
+                stats = scanner.ScanStats()
+                dedup = scanner.Deduplicator()
+                scanner.scan_folder(self.folder, out, jobs=jobs, stats=stats, dedup=dedup)
+                out.flush()
+                records = [json.loads(line) for line in out.stream.getvalue().splitlines()]
+                self.assertEqual(len(records), 2)
+                by_title = {r["docinfo"]["/Title"]: r for r in records}
+                same = by_title["Same"]
+                self.assertEqual(
+                    sorted([same["path"], *same["duplicates"]]), sorted([original, *copies])
+                )
+                self.assertEqual(by_title["Other"]["path"], other)
+                self.assertEqual(by_title["Other"]["duplicates"], [])
+                self.assertEqual(stats.files, 2)
+                self.assertEqual(stats.counters["duplicate_files"], 2)
+
+    def test_text_output_lists_duplicates(self):
+        original = make_pdf(os.path.join(self.folder, "a.pdf"))
+        with open(original, "rb") as f:
+            copy = self.write("copy/a.pdf", f.read())
+        out = StringIO()
+        scanner.scan_folder(self.folder, out, dedup=scanner.Deduplicator())
+        # Files are found before subfolders are entered, so a.pdf is the one scanned.
+        self.assertIn(f"[Duplicates] {original}\n    {copy}\n", out.getvalue())
+        self.assertNotIn(f"[PDF Metadata] {copy}", out.getvalue())
+
+    def test_duplicates_keep_their_cache_entries(self):
+        original = make_pdf(os.path.join(self.folder, "a.pdf"))
+        with open(original, "rb") as f:
+            copy = self.write("b.pdf", f.read())
+        cache_path = os.path.join(self.folder, "cache.sqlite")
+        for dedup in (None, scanner.Deduplicator()):
+            with scanner.ResultCache(cache_path) as cache:
+                scanner.scan_folder(self.folder, StringIO(), cache=cache, dedup=dedup)
+        with scanner.ResultCache(cache_path) as cache:
+            rows = cache.conn.execute("SELECT path FROM results ORDER BY path").fetchall()
+        self.assertEqual([r[0] for r in rows], [original, copy])
+
+
+class TestScanService(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_docs(4)
+
+    def assertScanned(self, output, count=4):
+        for i in range(len(self.paths)):
+            self.assertIn(f"/Title: T{i}", output)
+        self.assertEqual(output.count("[PDF Metadata]"), count)
+
+    def test_submitted_files_are_written_and_drained(self):
+        async def scenario(out):
+            async with scanner.ScanService(out, jobs=2, queue_size=1) as service:
+                for pdf_path in self.paths:
+                    await service.submit(pdf_path)
+
+        out = StringIO()
+        asyncio.run(scenario(out))
+        self.assertScanned(out.getvalue())
+
+    def test_full_queue_blocks_submit(self):
+        async def scenario():
+            service = scanner.ScanService(StringIO(), queue_size=1)
+            await service.submit(self.paths[0])
+            with self.assertRaises(TimeoutError):
+                await asyncio.wait_for(service.submit(self.paths[1]), 0.05)
+
+        asyncio.run(scenario())
+
+    def test_worker_crash_is_isolated(self):
+        bad = os.path.join(self.folder, "bad.pdf")
+
+        async def scenario(out):
+            async with scanner.ScanService(out, jobs=2) as service:
+                for pdf_path in [bad, *self.paths]:
+                    await service.submit(pdf_path)
+
+        out = StringIO()
+        with (
+            patch("scanner.scan_file", crash_on_bad_pdf),
+            self.assertLogs(level="ERROR") as cm,
+        ):
+            asyncio.run(scenario(out))
+        self.assertScanned(out.getvalue())
+        self.assertIn(f"Worker crashed while processing {bad}", "\n".join(cm.output))
+
+    def test_unix_socket(self):
+        address = os.path.join(self.tmp.name, "scan.sock")
+
+        async def scenario(out):
+            stop = asyncio.Event()
+            async with scanner.ScanService(out) as service:
+                server = asyncio.create_task(scanner.serve(address, service, stop))
+                while not os.path.exists(address):
+                    await asyncio.sleep(0.01)
+                reader, writer = await asyncio.open_unix_connection(address)
+                writer.write(f"{self.folder}\n\n{self.paths[0]}\n".encode())
+                replies = [await reader.readline(), await reader.readline()]
+                writer.close()
+                stop.set()
+                await server
+            return replies
+
+        out = StringIO()
+        replies = asyncio.run(scenario(out))
+        self.assertEqual(
+            replies, [f"queued 4 {self.folder}\n".encode(), f"queued 1 {self.paths[0]}\n".encode()]
+        )
+        self.assertScanned(out.getvalue(), 5)
+        self.assertEqual(out.getvalue().count("/Title: T0"), 2)
+        self.assertFalse(os.path.exists(address))
+
+
+class TestWatch(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = self.tmp.name
+        self.existing = make_pdf(os.path.join(self.folder, "old.pdf"), docinfo={"/Title": "Old"})
+        with open(self.existing, "rb") as f:
+            self.pdf_bytes = f.read()
+
+    async def collect(self, watcher, actions):
+        stop = asyncio.Event()
+        found = []
+
+        async def consume():
+            async for path in watcher.changes(stop):
+                found.append(path)
+
+        task = asyncio.create_task(consume())
+        for action in actions:
+            await asyncio.sleep(0.05)
+            action()
+        await asyncio.sleep(0.5)
+        stop.set()
+        await task
+        return found
+
+    def test_new_and_changed_files_are_reported_once_settled(self):
+        new = os.path.join(self.folder, "sub", "new.pdf")
+
+        def mkdir():
+            os.mkdir(os.path.dirname(new))
+
+        def write_half():
+            with open(new, "wb") as f:
+                f.write(self.pdf_bytes[:100])
+
+        def write_rest():
+            with open(new, "ab") as f:
+                f.write(self.pdf_bytes[100:])
+
+        def change_existing():
+            with open(self.existing, "ab") as f:
+                f.write(b"\n")
+
+        def ignore_other_files():
+            with open(os.path.join(self.folder, "notes.txt"), "w") as f:
+                f.write("x")
+
+        for poll_interval in (None, 0.02):
+            with self.subTest(poll_interval=poll_interval):
+                if os.path.isdir(os.path.dirname(new)):
+                    os.remove(new)
+                    os.rmdir(os.path.dirname(new))
+                watcher = scanner.FolderWatcher(
+                    self.folder, settle=0.2, poll_interval=poll_interval
+                )
+                watcher.start()
+                if poll_interval is None and sys.platform.startswith("linux"):
+                    self.assertIsNotNone(watcher.inotify)
+                actions = [mkdir, write_half, write_rest, change_existing, ignore_other_files]
+                found = asyncio.run(self.collect(watcher, actions))
+                self.assertEqual(sorted(found), sorted([new, self.existing]))
+
+    def test_watch_scans_folder_then_changes(self):
+        out = StringIO()
+
+        async def scenario():
+            stop = asyncio.Event()
+            async with scanner.ScanService(out) as service:
+                task = asyncio.create_task(
+                    scanner.watch(self.folder, service, stop, settle=0.05, poll_interval=0.02)
+                )
+                while "/Title: Old" not in out.getvalue():
+                    await asyncio.sleep(0.01)
+                make_pdf(os.path.join(self.folder, "new.pdf"), docinfo={"/Title": "New"})
+                while "/Title: New" not in out.getvalue():
+                    await asyncio.sleep(0.01)
+                stop.set()
+                await task
+
+        asyncio.run(asyncio.wait_for(scenario(), 10))
+        self.assertEqual(out.getvalue().count("[PDF Metadata]"), 2)
+
+
+class TestRecords(TempDirTestCase):
+    def test_values_are_stringified_when_written(self):
+        image = scanner.ImageRecord("/Im0", [1, 2], {"271": "Cam", "exif": b"II*\x00", "n": 3})
+        record = scanner.DocumentRecord("a.pdf", docinfo={"/Title": "T"}, images=[image])
+        self.assertEqual(image.metadata["exif"], b"II*\x00")
+        data = record.as_dict()
+        self.assertEqual(list(data), list(scanner.RECORD_FIELDS))
+        self.assertEqual(
+            data["images"][0]["metadata"], {"271": "Cam", "exif": "b'II*\\x00'", "n": 3}
+        )
+
+        restored = scanner.DocumentRecord.from_dict(json.loads(json.dumps(data)))
+        self.assertEqual(restored.as_dict(), data)
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+        self.assertFalse(hasattr(image, "__dict__"))
+
+    def test_images_share_key_names(self):
+        pdf_path = make_pdf_with_page_images(os.path.join(self.tmp.name, "a.pdf"), ["A", "B"])
+        first, second = scanner.process_pdf(pdf_path).images
+        self.assertEqual(list(first.metadata), list(second.metadata))
+        for a, b in zip(first.metadata, second.metadata, strict=True):
+            self.assertIs(a, b)
+
+
+class TestOutputFormats(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = os.path.join(self.tmp.name, "docs")
+        os.mkdir(self.folder)
+        self.paths = [
+            make_pdf(os.path.join(self.folder, "a.pdf"), docinfo={"/Title": "A"}, exif_make="Cam"),
+            make_pdf(os.path.join(self.folder, "b.pdf"), docinfo={"/Title": "Line\nbreak"}),
+        ]
+
+    def scan_to(self, output_format, **kwargs):
+        out_path = os.path.join(self.tmp.name, f"out.{output_format}")
+        with scanner.open_output(out_path, output_format) as out:
+            scanner.scan_folder(self.folder, out, **kwargs)
+        return out_path
+
+    def test_jsonl_has_one_record_per_document(self):
+        with open(self.scan_to("jsonl")) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(sorted(r["path"] for r in records), sorted(self.paths))
+        by_path = {r["path"]: r for r in records}
+        self.assertEqual(by_path[self.paths[1]]["docinfo"], {"/Title": "Line\nbreak"})
+        image = by_path[self.paths[0]]["images"][0]
+        self.assertEqual((image["name"], image["pages"]), ("/Im0", [1]))
+        self.assertEqual(image["metadata"]["271"], "Cam")
+
+    def test_jsonl_parallel_matches_serial(self):
+        with open(self.scan_to("jsonl")) as f:
+            serial = f.read()
+        with open(self.scan_to("jsonl", jobs=2)) as f:
+            self.assertEqual(f.read(), serial)
+
+    def test_text_writer_batches_writes(self):
+        records = [scanner.process_pdf(path) for path in self.paths]
+        expected = StringIO()
+        for record in records:
+            scanner.render_text(record, expected)
+
+        stream = StringIO()
+        with patch.object(stream, "write", wraps=stream.write) as write:
+            out = scanner.TextWriter(stream)
+            for record in records:
+                out.write(record)
+            self.assertEqual(write.call_count, 0)
+            out.flush()
+            self.assertEqual(write.call_count, 1)
+        self.assertEqual(stream.getvalue(), expected.getvalue())
+
+        small = scanner.TextWriter(StringIO(), batch_size=1)
+        small.write(records[0])
+        self.assertEqual(small.pending, [])
+        self.assertTrue(expected.getvalue().startswith(small.stream.getvalue()))
+
+    def test_csv_rows(self):
+        with open(self.scan_to("csv"), newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 2)
+        titles = sorted(json.loads(row["docinfo"])["/Title"] for row in rows)
+        self.assertEqual(titles, ["A", "Line\nbreak"])
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow not installed")
+    def test_parquet_row_groups(self):
+        import pyarrow.parquet as pq
+
+        out_path = os.path.join(self.tmp.name, "out.parquet")
+        with scanner.ParquetWriter(out_path, batch_size=1) as out:
+            scanner.scan_folder(self.folder, out)
+        parquet = pq.ParquetFile(out_path)
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        table = parquet.read().to_pylist()
+        self.assertEqual(sorted(row["path"] for row in table), sorted(self.paths))
+        image = next(row for row in table if row["images"])["images"][0]
+        self.assertIn(("271", '"Cam"'), image["metadata"])
+
+
+class TestScanStats(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            make_pdf(os.path.join(self.tmp.name, f"doc{i}.pdf"), exif_make="Cam", pages=2)
+
+    def test_serial_and_parallel_stats(self):
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                stats = scanner.ScanStats(top_n=2)
+                scanner.scan_folder(self.tmp.name, StringIO(), jobs=jobs, stats=stats)
+                snap = stats.snapshot()
+                self.assertEqual(snap["files"], 3)
+                self.assertEqual(snap["counters"]["pages"], 6)
+                self.assertGreater(snap["counters"]["image_bytes"], 0)
+                self.assertTrue({"total", "open", "docinfo", "images"} <= set(snap["stages"]))
+                self.assertEqual(len(snap["slowest"]), 2)
+                self.assertIn("slowest files:", stats.summary())
+
+    def test_periodic_json_lines(self):
+        stream = StringIO()
+        stats = scanner.ScanStats(interval=0, stream=stream)
+        scanner.scan_folder(self.tmp.name, StringIO(), stats=stats)
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line["files"] for line in lines], [1, 2, 3])
+
+    def test_cached_and_failed_files_are_counted(self):
+        stats = scanner.ScanStats()
+        stats.add(None)
+        stats.add(None, failed=True)
+        self.assertEqual((stats.files, stats.cached, stats.failed), (2, 1, 1))
+
+    def test_stages_are_noops_outside_track_file(self):
+        with scanner.stage("open"):
+            scanner.count("pages")
+        self.assertIsNone(scanner._file_stats)
+
+
+class TestResultCache(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_path = os.path.join(self.tmp.name, "cache.sqlite")
+        self.make_docs(3)
+
+    def scan(self, jobs=1, **cache_options):
+        out = StringIO()
+        with scanner.ResultCache(self.cache_path, **cache_options) as cache:
+            scanner.scan_folder(self.folder, out, jobs=jobs, cache=cache)
+        return out.getvalue(), cache.hits
+
+    def test_unchanged_files_are_replayed(self):
+        first, hits = self.scan()
+        self.assertEqual(hits, 0)
+        with patch("scanner.process_pdf") as proc:
+            second, hits = self.scan()
+        proc.assert_not_called()
+        self.assertEqual(hits, 3)
+        self.assertEqual(second, first)
+
+    def test_parallel_scan_uses_cache(self):
+        first, _ = self.scan()
+        second, hits = self.scan(jobs=2)
+        self.assertEqual(hits, 3)
+        self.assertEqual(second, first)
+
+    def test_modified_file_is_rescanned(self):
+        self.scan()
+        make_pdf(self.paths[1], docinfo={"/Title": "Changed title"})
+        os.utime(self.paths[1], ns=(1, 1))
+        output, hits = self.scan()
+        self.assertEqual(hits, 2)
+        self.assertIn("Changed title", output)
+
+    def test_content_hash_ignores_touch(self):
+        self.scan(hash_contents=True)
+        os.utime(self.paths[0], ns=(1, 1))
+        _, hits = self.scan(hash_contents=True)
+        self.assertEqual(hits, 3)
+
+    def test_rebuild_and_eviction(self):
+        self.scan()
+        os.remove(self.paths[2])
+        self.scan()
+        with scanner.ResultCache(self.cache_path) as cache:
+            rows = cache.conn.execute("SELECT path FROM results ORDER BY path").fetchall()
+        self.assertEqual([r[0] for r in rows], self.paths[:2])
+
+        _, hits = self.scan(rebuild=True)
+        self.assertEqual(hits, 0)
+
+    def cached_paths(self):
+        with scanner.ResultCache(self.cache_path) as cache:
+            rows = cache.conn.execute("SELECT path FROM results ORDER BY path").fetchall()
+        return [r[0] for r in rows]
+
+    def test_shards_keep_each_others_entries(self):
+        self.scan()
+        for k in (1, 2):
+            with scanner.ResultCache(self.cache_path) as cache:
+                scanner.scan_folder(self.folder, StringIO(), cache=cache, shard=(k, 2))
+        self.assertEqual(self.cached_paths(), self.paths)
+
+    def test_filtered_files_keep_their_entries(self):
+        self.scan()
+        with scanner.ResultCache(self.cache_path) as cache:
+            scanner.scan_folder(
+                self.folder, StringIO(), cache=cache, path_filter=scanner.PathFilter(["doc0*"])
+            )
+        self.assertEqual(self.cached_paths(), self.paths)
+
+    def test_files_below_min_pages_are_cached(self):
+        make_pdf(self.paths[0], docinfo={"/Title": "Long"}, pages=2)
+        for expected_hits in (0, 3):
+            out = StringIO()
+            with scanner.ResultCache(self.cache_path) as cache:
+                scanner.scan_folder(self.folder, out, cache=cache, min_pages=2)
+            self.assertEqual(cache.hits, expected_hits)
+            self.assertEqual(out.getvalue().count("[PDF Metadata]"), 1)
+            self.assertIn("/Title: Long", out.getvalue())
+
+    def test_options_are_part_of_the_key(self):
+        self.scan()
+        _, hits = self.scan(options={"backend": "pypdf"})
+        self.assertEqual(hits, 0)
+
+    def test_cached_warnings_are_replayed(self):
+        broken = os.path.join(self.folder, "broken.pdf")
+        with open(broken, "w") as f:
+            f.write("not a pdf")
+        with self.assertLogs(level="WARNING"):
+            self.scan()
+        with self.assertLogs(level="WARNING") as cm:
+            self.scan()
+        self.assertIn("Could not extract PDF metadata", "\n".join(cm.output))
+
+
+class TestResume(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_docs(5)
+
+    def read(self, path):
+        with open(path, encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def interrupted_scan(self, out_path, output_format, journal, after):
+        # A checkpoint after every file, then the scan dies part-way through a file.
+        real_process_pdf = scanner.process_pdf
+        calls = []
+
+        def process_pdf(*args, **kwargs):
+            calls.append(args[0])
+            if len(calls) > after:
+                raise KeyboardInterrupt
+            return real_process_pdf(*args, **kwargs)
+
+        checkpoint = scanner.Checkpoint(journal, interval=0)
+        out = scanner.open_output(out_path, output_format)
+        checkpoint.start(out)
+        with patch.object(scanner, "process_pdf", side_effect=process_pdf):
+            with self.assertRaises(KeyboardInterrupt):
+                scanner.scan_folder(self.folder, out, checkpoint=checkpoint)
+        checkpoint.journal.close()
+        out.close()
+        # Output written after the last checkpoint and a half-written journal line.
+        with open(out_path, "a", encoding="utf-8") as f:
+            f.write("partial rec")
+        with open(journal, "a", encoding="utf-8") as f:
+            f.write('{"offset": 1')
+
+    def test_resume_appends_the_remaining_files(self):
+        for output_format in ("text", "jsonl", "csv"):
+            reference = os.path.join(self.tmp.name, f"reference.{output_format}")
+            with scanner.open_output(reference, output_format) as out:
+                scanner.scan_folder(self.folder, out)
+
+            for jobs in (1, 2):
+                with self.subTest(output_format=output_format, jobs=jobs):
+                    out_path = os.path.join(self.tmp.name, f"out{jobs}.{output_format}")
+                    journal = out_path + scanner.JOURNAL_SUFFIX
+                    self.interrupted_scan(out_path, output_format, journal, after=3)
+
+                    checkpoint = scanner.Checkpoint(journal)
+                    self.assertTrue(checkpoint.resume(out_path))
+                    self.assertEqual(len(checkpoint.finished), 3)
+                    with scanner.open_output(out_path, output_format, append=True) as out:
+                        checkpoint.start(out, append=True)
+                        with patch("scanner.process_pdf", wraps=scanner.process_pdf) as proc:
+                            scanner.scan_folder(self.folder, out, jobs=jobs, checkpoint=checkpoint)
+                        checkpoint.close(complete=True)
+                    if jobs == 1:
+                        self.assertEqual(proc.call_count, 2)
+                    self.assertEqual(self.read(out_path), self.read(reference))
+                    self.assertFalse(os.path.exists(journal))
+
+    def test_resume_keeps_cache_entries(self):
+        cache_path = os.path.join(self.tmp.name, "cache.sqlite")
+        with scanner.ResultCache(cache_path) as cache:
+            scanner.scan_folder(self.folder, StringIO(), cache=cache)
+        out_path = os.path.join(self.tmp.name, "out.jsonl")
+        journal = out_path + scanner.JOURNAL_SUFFIX
+        self.interrupted_scan(out_path, "jsonl", journal, after=2)
+
+        checkpoint = scanner.Checkpoint(journal)
+        self.assertTrue(checkpoint.resume(out_path))
+        with (
+            scanner.open_output(out_path, "jsonl", append=True) as out,
+            scanner.ResultCache(cache_path) as cache,
+        ):
+            checkpoint.start(out, append=True)
+            scanner.scan_folder(self.folder, out, cache=cache, checkpoint=checkpoint)
+            checkpoint.close(complete=True)
+        self.assertEqual(cache.hits, 3)
+        with scanner.ResultCache(cache_path) as cache:
+            (count,) = cache.conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        self.assertEqual(count, 5)
+
+    def test_resume_without_journal_starts_afresh(self):
+        out_path = os.path.join(self.tmp.name, "out.jsonl")
+        checkpoint = scanner.Checkpoint(out_path + scanner.JOURNAL_SUFFIX)
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(checkpoint.resume(out_path))
+        self.assertEqual(checkpoint.finished, set())
+
+    def test_cli_resume(self):
+        out_path = os.path.join(self.tmp.name, "out.jsonl")
+        log_path = os.path.join(self.tmp.name, "scan.log")
+        journal = out_path + scanner.JOURNAL_SUFFIX
+        self.interrupted_scan(out_path, "jsonl", journal, after=2)
+        argv = ["pdfscan", self.folder, "-o", out_path, "-l", log_path, "-f", "jsonl"]
+        with patch.object(sys, "argv", [*argv, "--resume"]), patch("scanner.setup_logger"):
+            scanner.main()
+        with open(out_path) as f:
+            titles = sorted(json.loads(line)["docinfo"]["/Title"] for line in f)
+        self.assertEqual(titles, [f"T{i}" for i in range(5)])
+        self.assertFalse(os.path.exists(journal))
+
+
 if __name__ == "__main__":
     unittest.main()